@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+audio_cache_dir = os.getenv("AUDIO_CACHE_DIR")  # Disabled when unset
+audio_cache_min_plays = int(os.getenv("AUDIO_CACHE_MIN_PLAYS", "3"))
+audio_cache_max_bytes = int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+INDEX_FILE = "index.json"
+
+
+def file_sha256(path):
+    """Hash a file in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AudioCache:
+    """Size-bounded LRU directory of downloaded audio for frequently played videos"""
+
+    def __init__(self, directory, min_plays=audio_cache_min_plays, max_bytes=audio_cache_max_bytes):
+        self.directory = directory
+        self.min_plays = min_plays
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        self.play_counts = {}  # video ID -> plays since startup
+        self.downloading = set()
+        self._verified = set()  # Files whose hash has been checked this run
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # yt_dlp options that download straight into the cache directory, preferring Opus
+        self.download_opts = {
+            'format': 'bestaudio[acodec=opus]/bestaudio/best',
+            'noplaylist': True,
+            'quiet': True,
+            'outtmpl': os.path.join(directory, '%(id)s.%(ext)s'),
+        }
+
+        os.makedirs(directory, exist_ok=True)
+        self.index = self._load_index()
+
+    def _load_index(self):
+        """Read the index, dropping entries whose file is missing or has the wrong size"""
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        for video_id, item in list(index.items()):
+            path = os.path.join(self.directory, item['file'])
+            if not os.path.isfile(path) or os.path.getsize(path) != item['size']:
+                del index[video_id]
+        return index
+
+    def _save_index(self):
+        """Write the index atomically so a crash never leaves it half written"""
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(path + '.tmp', path)
+
+    def lookup(self, video_id):
+        """Return a playable entry for a cached video, or None"""
+        with self._lock:
+            item = self.index.get(video_id)
+            if item is None:
+                self.misses += 1
+                return None
+
+            path = os.path.join(self.directory, item['file'])
+            if not self._is_intact(video_id, item, path):
+                self._remove(video_id)
+                self._save_index()
+                self.misses += 1
+                return None
+
+            item['last_used'] = time.time()
+            self.hits += 1
+            return {
+                'video_id': video_id,
+                'stream_url': path,
+                'title': item['title'],
+                'video_url': f"https://www.youtube.com/watch?v={video_id}",
+                'duration': item.get('duration'),
+                'acodec': item.get('acodec'),
+                'local': True,
+            }
+
+    def _is_intact(self, video_id, item, path):
+        """Check the file size every time and the full hash once per run"""
+        try:
+            if os.path.getsize(path) != item['size']:
+                return False
+        except OSError:
+            return False
+
+        if video_id not in self._verified:
+            if file_sha256(path) != item['sha256']:
+                print(f"Audio cache file for {video_id} is corrupt, removing it")
+                return False
+            self._verified.add(video_id)
+        return True
+
+    def record_play(self, video_id):
+        """Count a play and return True if the video should now be downloaded"""
+        with self._lock:
+            plays = self.play_counts.get(video_id, 0) + 1
+            self.play_counts[video_id] = plays
+            if plays < self.min_plays or video_id in self.index or video_id in self.downloading:
+                return False
+            self.downloading.add(video_id)
+            return True
+
+    def download(self, ydl, video_id):
+        """Download a video's audio into the cache with the given YoutubeDL (blocking), errors reach the caller"""
+        try:
+            info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=True)
+            path = ydl.prepare_filename(info)
+            size = os.path.getsize(path)
+            if size == 0:
+                raise ValueError("downloaded file is empty")
+
+            item = {
+                'file': os.path.basename(path),
+                'size': size,
+                'sha256': file_sha256(path),
+                'title': info.get('title'),
+                'duration': info.get('duration'),
+                'acodec': info.get('acodec'),
+                'last_used': time.time(),
+            }
+            with self._lock:
+                self.index[video_id] = item
+                self._verified.add(video_id)
+                self._evict()
+                self._save_index()
+        finally:
+            with self._lock:
+                self.downloading.discard(video_id)
+
+    def _evict(self):
+        """Remove least recently used files until the cache fits its byte budget"""
+        total = sum(item['size'] for item in self.index.values())
+        for video_id, item in sorted(self.index.items(), key=lambda pair: pair[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= item['size']
+            self._remove(video_id)
+            self.evictions += 1
+
+    def _remove(self, video_id):
+        item = self.index.pop(video_id)
+        self._verified.discard(video_id)
+        try:
+            os.remove(os.path.join(self.directory, item['file']))
+        except OSError:
+            pass
+
+    def stats(self):
+        """Return hit/miss counters and the cache size"""
+        with self._lock:
+            return {
+                'files': len(self.index),
+                'bytes': sum(item['size'] for item in self.index.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
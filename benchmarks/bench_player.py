@@ -0,0 +1,255 @@
+"""Offline benchmarks for MusicPlayer resolution, ingestion and queue operations.
+
+Run from the repository root:
+    python -m benchmarks.bench_player --output bench_output.txt
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import tracemalloc
+
+# Keep the benchmark away from real caches, ports and credentials
+os.environ["MATCH_CACHE_PATH"] = ":memory:"
+os.environ["STATE_PATH"] = ""
+os.environ.pop("AUDIO_CACHE_DIR", None)
+os.environ.pop("METRICS_PORT", None)
+# Worker processes would import the real yt_dlp instead of the fakes
+os.environ.pop("EXTRACTION_PROCESSES", None)
+# Measure ingestion itself rather than the configured pacing
+os.environ["GUILD_INGEST_RATE"] = "0"
+
+from benchmarks import fakes  # noqa: E402
+
+fakes.install()
+
+import resolver  # noqa: E402
+from music_player import MusicPlayer  # noqa: E402
+from metrics import monitor_event_loop  # noqa: E402
+from url_router import parse_ref  # noqa: E402
+from track_queue import Track  # noqa: E402
+
+
+def fresh_resolver():
+    """Start every benchmark with empty caches"""
+    resolver._resolver = resolver.Resolver()
+    return resolver._resolver
+
+
+def make_player(loop, guild_id=1):
+    guild = fakes.FakeGuild(guild_id)
+    player = MusicPlayer(fakes.FakeBot(loop), guild)
+    return player, fakes.FakeInteraction(guild)
+
+
+def fill_queue(player, size):
+    for index in range(size):
+        player.queue.append(Track(f"https://www.youtube.com/watch?v={index:011d}", f"Track {index}",
+                                  video_id=f"{index:011d}", duration=180))
+
+
+async def wait_for_ingest(player):
+    while player.ingest_tasks:
+        await asyncio.gather(*player.ingest_tasks, return_exceptions=True)
+
+
+async def bench_process_playlist(loop, kind, size):
+    """Time to queue a whole playlist and until its first song starts"""
+    fresh_resolver()
+    fakes.CONFIG.playlist_size = size
+    player, interaction = make_player(loop)
+    voice_client = player.guild.voice_client
+
+    url = ("https://www.youtube.com/playlist?list=PLbench" if kind == 'youtube'
+           else "https://open.spotify.com/playlist/benchplaylist000000000")
+    lags = []
+    monitor = asyncio.create_task(monitor_event_loop(0.01, lags))
+    start = time.perf_counter()
+    await player.process_playlist(interaction, url)
+    await wait_for_ingest(player)
+    elapsed = time.perf_counter() - start
+    monitor.cancel()
+
+    queued = len(player.queue) + (1 if voice_client.plays else 0)
+    player.close()
+    return {
+        'tracks': queued,
+        'seconds': elapsed,
+        'tracks_per_second': queued / elapsed if elapsed else None,
+        'time_to_first_audio': voice_client.started_at - start if voice_client.started_at else None,
+        'max_event_loop_lag': max(lags, default=None),
+    }
+
+
+async def bench_time_to_first_audio(loop, runs):
+    """Time from /play until the voice client starts, cold (extraction) and warm (stream cache hit)"""
+    fresh_resolver()
+    cold, warm = [], []
+    for index in range(runs):
+        for samples in (cold, warm):
+            player, interaction = make_player(loop)
+            start = time.perf_counter()
+            await player.play(interaction, f"https://www.youtube.com/watch?v=bench{index:06d}")
+            samples.append(player.guild.voice_client.started_at - start)
+            player.close()
+    return {'cold': summarize(cold), 'warm': summarize(warm)}
+
+
+def bench_shuffle(loop, sizes, repeat):
+    """Cost of shuffle_queue at large queue sizes"""
+    results = {}
+    for size in sizes:
+        player, _ = make_player(loop)
+        fill_queue(player, size)
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            player.shuffle_queue()
+            samples.append(time.perf_counter() - start)
+        results[str(size)] = summarize(samples)
+    return results
+
+
+async def bench_play_next(loop, sizes, repeat):
+    """Cost of play_next with a large queue, streams come from the stream cache"""
+    results = {}
+    for size in sizes:
+        fresh_resolver()
+        player, _ = make_player(loop)
+        fill_queue(player, size)
+
+        # Warm the stream cache so the numbers reflect queue handling rather than fake extraction latency
+        for track in player.queue.head(repeat + player.prefetch_ahead + 1):
+            await player.resolve_entry(track.source)
+
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            await player.play_next()
+            samples.append(time.perf_counter() - start)
+        player.close()
+        results[str(size)] = summarize(samples)
+    return results
+
+
+def bench_memory(loop, guilds, queue_size):
+    """Bytes allocated per guild for a player holding a queue"""
+    fresh_resolver()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    players = []
+    for guild_id in range(guilds):
+        player, _ = make_player(loop, guild_id)
+        fill_queue(player, queue_size)
+        players.append(player)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return {
+        'guilds': guilds,
+        'queue_size': queue_size,
+        'bytes_per_guild': allocated / guilds,
+        'bytes_per_track': allocated / (guilds * queue_size) if queue_size else None,
+    }
+
+
+# Mix of what /play receives, from plain searches to shortlinks with timestamps
+CLASSIFY_INPUTS = [
+    "never gonna give you up",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://youtu.be/dQw4w9WgXcQ?t=1m30s",
+    "https://music.youtube.com/watch?v=dQw4w9WgXcQ&feature=share",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLFgquLnL59alCl_2TQvOiD5Vgm1hCaGSI",
+    "https://www.youtube.com/playlist?list=PLFgquLnL59alCl_2TQvOiD5Vgm1hCaGSI",
+    "https://www.youtube.com/shorts/dQw4w9WgXcQ",
+    "https://open.spotify.com/track/4cOdK2wGLETKBW3PvgPWqT?si=abc",
+    "https://open.spotify.com/intl-de/album/4cOdK2wGLETKBW3PvgPWqT",
+    "https://open.spotify.com/playlist/37i9dQZF1DXcBWIGoYBM5M",
+]
+
+
+def bench_classify(count):
+    """Throughput of turning /play input into a typed reference"""
+    inputs = (CLASSIFY_INPUTS * (count // len(CLASSIFY_INPUTS) + 1))[:count]
+    start = time.perf_counter()
+    for text in inputs:
+        parse_ref(text)
+    elapsed = time.perf_counter() - start
+    return {'inputs': count, 'seconds': elapsed, 'per_second': count / elapsed if elapsed else None}
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'mean': statistics.mean(samples),
+        'median': statistics.median(samples),
+        'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        'max': samples[-1],
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    loop = asyncio.get_running_loop()
+    fakes.CONFIG.__init__(extract_latency=args.latency, search_latency=args.latency * 2,
+                          playlist_latency=args.latency * 4, spotify_latency=args.latency,
+                          failure_rate=args.failure_rate)
+
+    results = {}
+    results['process_playlist_youtube'] = await bench_process_playlist(loop, 'youtube', args.playlist_size)
+    results['process_playlist_spotify'] = await bench_process_playlist(loop, 'spotify', args.playlist_size)
+    results['time_to_first_audio'] = await bench_time_to_first_audio(loop, args.runs)
+    results['shuffle_queue'] = bench_shuffle(loop, args.queue_sizes, args.runs)
+    results['play_next'] = await bench_play_next(loop, args.queue_sizes, args.runs)
+    results['memory'] = bench_memory(loop, args.guilds, args.memory_queue_size)
+    results['classify'] = bench_classify(args.classify_count)
+    results['fake_calls'] = dict(fakes.CONFIG.calls)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline MusicPlayer benchmarks")
+    parser.add_argument("--latency", type=float, default=0.02, help="Fake extraction latency in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of fake calls that fail")
+    parser.add_argument("--playlist-size", type=int, default=500)
+    parser.add_argument("--queue-sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--memory-queue-size", type=int, default=100)
+    parser.add_argument("--classify-count", type=int, default=100000, help="Inputs classified by the URL router")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'timestamp': time.time(),
+        'parameters': vars(args),
+        'results': asyncio.run(run(args)),
+    }
+    resolver.get_resolver().shutdown()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
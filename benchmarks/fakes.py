@@ -0,0 +1,271 @@
+"""Local stand-ins for yt_dlp, spotipy and discord so MusicPlayer can be benchmarked offline.
+
+install() must run before music_player (or anything importing it) is imported.
+"""
+import sys
+import time
+import types
+import random
+import asyncio
+import hashlib
+import threading
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeConfig:
+    """Latency (seconds) and failure injection shared by every fake"""
+
+    def __init__(self, extract_latency=0.05, search_latency=0.1, playlist_latency=0.2, spotify_latency=0.05,
+                 failure_rate=0.0, seed=1234):
+        self.extract_latency = extract_latency
+        self.search_latency = search_latency
+        self.playlist_latency = playlist_latency
+        self.spotify_latency = spotify_latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self.playlist_size = 100  # Entries in every fake YouTube playlist and Spotify playlist
+        self.calls = {}
+
+    def hit(self, kind, latency):
+        """Record a call, sleep for its latency and maybe fail it"""
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+            fail = self.random.random() < self.failure_rate
+        if latency:
+            time.sleep(latency)
+        if fail:
+            raise DownloadError(f"Injected {kind} failure")
+
+
+CONFIG = FakeConfig()
+
+
+class DownloadError(Exception):
+    pass
+
+
+def fake_video_id(text):
+    """Deterministic 11 character video ID for a search query"""
+    return hashlib.sha1(text.encode()).hexdigest()[:11]
+
+
+def _video_info(video_id, title=None):
+    expire = int(time.time()) + 6 * 3600
+    return {
+        'id': video_id,
+        'title': title or f"Video {video_id}",
+        'url': f"https://rr1---sn-fake.googlevideo.com/videoplayback?expire={expire}&id={video_id}",
+        'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+        'duration': 180,
+        'acodec': 'opus',
+        'ext': 'webm',
+    }
+
+
+class FakeYoutubeDL:
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def extract_info(self, url, download=False, **kwargs):
+        flat = self.params.get('extract_flat')
+
+        if url.startswith('ytsearch'):
+            prefix, query = url.split(':', 1)
+            count = int(prefix[len('ytsearch'):] or 1)
+            CONFIG.hit('search', CONFIG.search_latency)
+            entries = [_video_info(fake_video_id(f"{query}#{index}"), f"{query} result {index}")
+                       for index in range(count)]
+            if flat:
+                entries = [{'id': entry['id'], 'title': entry['title'], 'duration': entry['duration']}
+                           for entry in entries]
+            return {'_type': 'playlist', 'entries': entries}
+
+        query = parse_qs(urlparse(url).query)
+        if 'list' in query and flat:
+            CONFIG.hit('playlist', CONFIG.playlist_latency)
+            playlist_id = query['list'][0]
+            return {'_type': 'playlist', 'entries': [
+                {'id': fake_video_id(f"{playlist_id}#{index}"), 'title': f"{playlist_id} track {index}",
+                 'duration': 180}
+                for index in range(CONFIG.playlist_size)]}
+
+        CONFIG.hit('extract', CONFIG.extract_latency)
+        video_id = query.get('v', [fake_video_id(url)])[0]
+        return _video_info(video_id)
+
+    def prepare_filename(self, info):
+        return f"{info['id']}.{info.get('ext', 'webm')}"
+
+
+class FakeSpotifyClientCredentials:
+    def __init__(self, client_id=None, client_secret=None):
+        pass
+
+
+class FakeSpotify:
+    def __init__(self, auth_manager=None):
+        pass
+
+    @staticmethod
+    def _track(track_id):
+        return {'id': track_id, 'name': f"Song {track_id}", 'duration_ms': 180000,
+                'artists': [{'name': f"Artist {track_id[-3:]}"}]}
+
+    def _page(self, kind, collection_id, offset, limit, wrap):
+        CONFIG.hit('spotify', CONFIG.spotify_latency)
+        total = CONFIG.playlist_size
+        end = min(total, offset + limit)
+        tracks = [self._track(f"{collection_id[:12]}{index:010d}") for index in range(offset, end)]
+        return {
+            'items': [{'track': track} for track in tracks] if wrap else tracks,
+            'next': f"fake://{kind}/{collection_id}?offset={end}&limit={limit}" if end < total else None,
+            'total': total,
+        }
+
+    def playlist_items(self, playlist_id, fields=None, limit=100, offset=0, additional_types=None):
+        return self._page('playlist', playlist_id, offset, limit, wrap=True)
+
+    def album_tracks(self, album_id, limit=50, offset=0):
+        return self._page('album', album_id, offset, limit, wrap=False)
+
+    def track(self, track_id):
+        CONFIG.hit('spotify', CONFIG.spotify_latency)
+        return self._track(track_id)
+
+    def next(self, results):
+        parsed = urlparse(results['next'])
+        query = parse_qs(parsed.query)
+        return self._page(parsed.netloc, parsed.path.strip('/'), int(query['offset'][0]), int(query['limit'][0]),
+                          wrap=parsed.netloc == 'playlist')
+
+
+class FakeAudioSource:
+    def __init__(self, source=None, **kwargs):
+        self.source = kwargs.get('source', source)
+        self.cleaned_up = False
+
+    def read(self):
+        return b'\x00' * 3840
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+
+class FakeOpusAudio(FakeAudioSource):
+    def is_opus(self):
+        return True
+
+
+class FakeVoiceClient:
+    """Records when playback starts, finish() plays the role of the audio thread reaching the end"""
+
+    def __init__(self):
+        self.source = None
+        self.after = None
+        self.paused = False
+        self.started_at = None
+        self.plays = 0
+
+    def play(self, source, after=None):
+        self.source = source
+        self.after = after
+        self.paused = False
+        self.started_at = time.perf_counter()
+        self.plays += 1
+
+    def is_playing(self):
+        return self.source is not None and not self.paused
+
+    def is_paused(self):
+        return self.source is not None and self.paused
+
+    def is_connected(self):
+        return True
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def stop(self):
+        self.finish()
+
+    def finish(self, error=None):
+        after = self.after
+        self.source = None
+        self.after = None
+        if after:
+            after(error)
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.voice_client = FakeVoiceClient()
+
+
+class FakeChannel:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, content, **kwargs):
+        self.messages.append(content)
+
+
+class FakeUser:
+    id = 1
+    display_name = "bench"
+    voice = None
+
+
+class FakeInteraction:
+    def __init__(self, guild):
+        self.guild = guild
+        self.user = FakeUser()
+        self.channel = FakeChannel()
+        self.followup = self.channel
+
+
+class FakeBot:
+    def __init__(self, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+
+
+def install():
+    """Register the fake modules in sys.modules"""
+    yt_dlp = types.ModuleType('yt_dlp')
+    yt_dlp.YoutubeDL = FakeYoutubeDL
+    yt_dlp.utils = types.ModuleType('yt_dlp.utils')
+    yt_dlp.utils.DownloadError = DownloadError
+
+    spotipy = types.ModuleType('spotipy')
+    spotipy.Spotify = FakeSpotify
+    spotipy.oauth2 = types.ModuleType('spotipy.oauth2')
+    spotipy.oauth2.SpotifyClientCredentials = FakeSpotifyClientCredentials
+
+    discord = types.ModuleType('discord')
+    discord.AudioSource = FakeAudioSource
+    discord.FFmpegPCMAudio = FakeAudioSource
+    discord.FFmpegOpusAudio = FakeOpusAudio
+
+    modules = {
+        'yt_dlp': yt_dlp, 'yt_dlp.utils': yt_dlp.utils,
+        'spotipy': spotipy, 'spotipy.oauth2': spotipy.oauth2,
+        'discord': discord,
+    }
+
+    # python-dotenv has no side effects worth benchmarking, only stand in for it when it is missing
+    try:
+        import dotenv  # noqa: F401
+    except ImportError:
+        dotenv = types.ModuleType('dotenv')
+        dotenv.load_dotenv = lambda *args, **kwargs: False
+        modules['dotenv'] = dotenv
+
+    sys.modules.update(modules)
@@ -1,7 +1,9 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
-import asyncio
+from queue_view import QueueView
+from search_view import SearchView
+from url_router import parse_ref, UNSUPPORTED, UNSUPPORTED_MESSAGE
 
 
 class BotCommands:
@@ -45,6 +47,18 @@ class BotCommands:
                 await interaction.followup.send("Mao has joined your great empire!")
             except Exception as e:
                 await interaction.followup.send(f"Error joining voice channel: {str(e)}")
+                return
+
+            # Pick up where this server left off before a restart
+            player = self.get_music_player(interaction.guild)
+            # Now playing and skip messages of the restored queue go to this channel
+            player.last_interaction = interaction
+            restored = await player.restore_state()
+            if restored:
+                await interaction.followup.send(f"Restored {restored} songs from before the restart.")
+            elif player.queue:
+                # Resume a queue left over from a dropped voice connection, at the interrupted song's offset
+                await player.play_next()
 
         @self.bot.tree.command(name="leave", description="Leave the voice channel")
         async def leave(interaction: discord.Interaction):
@@ -82,8 +96,9 @@ class BotCommands:
                     await interaction.followup.send(f"Error connecting to voice channel: {str(e)}")
                     return
 
-            # Get music player and play the song
+            # Get music player and play the song, after any queue saved before a restart
             player = self.get_music_player(interaction.guild)
+            await player.restore_state(autoplay=False)
             await player.play(interaction, query)
 
         @self.bot.tree.command(name="search", description="Search for a song on YouTube")
@@ -100,77 +115,11 @@ class BotCommands:
                 await interaction.followup.send("No results found.")
                 return
 
-            # Create a list of results with numbers
-            result_message = "**Search Results:**\n"
-            for i, result in enumerate(results, 1):
-                result_message += f"{i}. {result['title']}\n"
-            result_message += "\nType the number of the song you want to play."
-
-            # Send the results
-            await interaction.followup.send(result_message)
-
-            # Wait for user's response
-            try:
-                # Create a check function to verify the response is from the original user and in the same channel
-                def check(msg):
-                    return (
-                            msg.author.id == interaction.user.id
-                            and msg.channel.id == interaction.channel.id
-                            and msg.content.isdigit()
-                            and 1 <= int(msg.content) <= len(results)
-                    )
-
-                # Wait for response
-                msg = await self.bot.wait_for('message', check=check, timeout=30.0)
-                choice = int(msg.content)
-                selected = results[choice - 1]
-
-                # Send a new message to indicate processing
-                process_msg = await interaction.channel.send(f"Processing your selection: {selected['title']}...")
-
-                # Check if user is in a voice channel
-                if not interaction.user.voice:
-                    await interaction.channel.send("You need to be in a voice channel to play music.")
-                    return
-
-                voice_channel = interaction.user.voice.channel
-
-                # Connect to voice channel if not already connected
-                voice_client = interaction.guild.voice_client
-                if not voice_client:
-                    try:
-                        voice_client = await voice_channel.connect()
-                    except Exception as e:
-                        await interaction.channel.send(f"Error connecting to voice channel: {str(e)}")
-                        return
-
-                # Play the selected song using the player.play method which now properly processes URLs
-                player.last_interaction = interaction  # Store the original interaction
-
-                # Create a DummyInteraction that has a channel send method
-                class DummyFollowup:
-                    def __init__(self, channel):
-                        self.channel = channel
-
-                    async def send(self, content):
-                        return await self.channel.send(content)
-
-                class DummyInteraction:
-                    def __init__(self, interaction, channel):
-                        self.guild = interaction.guild
-                        self.user = interaction.user
-                        self.channel = channel
-                        self.followup = DummyFollowup(channel)
+            # Resolve the top results while the user is choosing, so the pick starts playing right away
+            player.prefetch_search_results(results)
 
-                dummy = DummyInteraction(interaction, interaction.channel)
-
-                # Use the video URL from the search results
-                await player.play(dummy, selected['url'])
-
-            except asyncio.TimeoutError:
-                await interaction.channel.send("Selection timed out.")
-            except Exception as e:
-                await interaction.channel.send(f"Error processing selection: {str(e)}")
+            view = SearchView(player, interaction.user, results)
+            view.message = await interaction.followup.send("**Search Results:**", view=view, wait=True)
 
         @self.bot.tree.command(name="stop", description="Stop playing and clear the queue")
         async def stop(interaction: discord.Interaction):
@@ -220,27 +169,37 @@ class BotCommands:
                 await interaction.followup.send("I need to join a voice channel first! Use /join")
                 return
 
+            player = self.get_music_player(interaction.guild)
+            await player.restore_state(autoplay=False)
+
             # Check if it's a playlist
-            if ("youtube.com/playlist" in query or "youtube.com/watch" in query and "list=" in query or
-                    "spotify.com/playlist/" in query or "spotify.com/album/" in query):
-                player = self.get_music_player(interaction.guild)
+            ref = parse_ref(query)
+            if ref.is_playlist:
                 await player.process_playlist(interaction, query)
                 return
+            if ref.kind == UNSUPPORTED:
+                await interaction.followup.send(UNSUPPORTED_MESSAGE)
+                return
 
-            player = self.get_music_player(interaction.guild)
-            title = await player.add_to_queue(query)
+            if player.queue_full():
+                await interaction.followup.send(f"The queue is full ({player.max_queue_length} songs).")
+                return
+
+            title = await player.add_to_queue(query, interaction)
             await interaction.followup.send(f"Added to queue: {title}")
 
         @self.bot.tree.command(name="show_queue", description="Show the current song queue")
         async def show_queue(interaction: discord.Interaction):
             """Show the current song queue"""
             player = self.get_music_player(interaction.guild)
-            queue_list = player.get_queue_info()
-            if queue_list:
-                queue_text = "\n".join([f"{i + 1}. {title}" for i, title in enumerate(queue_list)])
-                await interaction.response.send_message(f"**Current Queue:**\n{queue_text}")
-            else:
+            if not (player.queue or player.current_song or player.ingest_tasks):
                 await interaction.response.send_message("Queue is empty.")
+                return
+
+            # Only the visible page is rendered, the buttons page through the rest
+            view = QueueView(player)
+            await interaction.response.send_message(embed=view.build_embed(), view=view)
+            view.message = await interaction.original_response()
 
         @self.bot.tree.command(name="skip", description="Skip to the next song in the queue")
         async def skip(interaction: discord.Interaction):
@@ -290,12 +249,12 @@ class BotCommands:
                     return
 
             # Verify it's a playlist URL
-            if not any(x in url for x in
-                       ["youtube.com/playlist", "youtube.com/watch?v=", "spotify.com/playlist/", "spotify.com/album/"]):
+            if not parse_ref(url).is_playlist:
                 await interaction.followup.send(
                     "That doesn't look like a valid playlist URL. Please provide a YouTube or Spotify playlist link.")
                 return
 
             # Process the playlist
             player = self.get_music_player(interaction.guild)
+            await player.restore_state(autoplay=False)
             await player.process_playlist(interaction, url)
\ No newline at end of file
@@ -0,0 +1,50 @@
+# yt_dlp extraction reduced to the fields the bot uses. Runs on a resolver thread, or in an
+# extraction worker process that keeps its YoutubeDL instances (and their player JS cache)
+# warm and only sends the compact result back.
+
+# Option set -> YoutubeDL, only used inside worker processes
+_instances = {}
+
+
+def compact_stream(info):
+    """Keep the fields of a full extraction that a stream entry needs"""
+    if info.get('_type') == 'playlist':
+        # Searches and playlist URLs resolve to their first item
+        info = info['entries'][0]
+    return {
+        'id': info.get('id'),
+        'url': info['url'],
+        'title': info['title'],
+        'webpage_url': info.get('webpage_url'),
+        'duration': info.get('duration'),
+        'acodec': info.get('acodec'),
+    }
+
+
+def compact_flat(info):
+    """Keep id, title and duration of each entry of a flat playlist or search listing"""
+    return [{'id': entry['id'], 'title': entry.get('title'), 'duration': entry.get('duration')}
+            for entry in info.get('entries') or () if entry]
+
+
+def get_ydl(ydl_opts):
+    key = tuple(sorted(ydl_opts.items()))
+    ydl = _instances.get(key)
+    if ydl is None:
+        import yt_dlp
+        ydl = _instances[key] = yt_dlp.YoutubeDL(dict(ydl_opts))
+    return ydl
+
+
+def warm_up(*option_sets):
+    """Process pool initializer, builds the YoutubeDL instances before the first job arrives"""
+    for ydl_opts in option_sets:
+        get_ydl(ydl_opts)
+
+
+def extract_stream(url, ydl_opts):
+    return compact_stream(get_ydl(ydl_opts).extract_info(url, download=False))
+
+
+def extract_flat(url, ydl_opts):
+    return compact_flat(get_ydl(ydl_opts).extract_info(url, download=False))
@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import urllib.request
+import multiprocessing
+import dotenv
+
+dotenv.load_dotenv()
+
+bot_token = os.getenv("DISCORD_BOT_TOKEN")
+shard_count_env = os.getenv("SHARD_COUNT")  # Ask Discord for its recommendation when unset
+worker_processes = int(os.getenv("WORKER_PROCESSES", str(os.cpu_count() or 1)))
+# Discord allows one IDENTIFY per five seconds, so later workers wait for the earlier shards to connect
+IDENTIFY_INTERVAL = 5
+RESTART_DELAY = 10
+
+
+def recommended_shard_count(token):
+    """Ask the Discord gateway how many shards this bot should run"""
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}",
+                 "User-Agent": "DiscordBot (https://github.com/z-tofu/music_bot, 1.0)"})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)['shards']
+
+
+def split_shards(shard_count, workers):
+    """Split shard IDs into contiguous ranges, one per worker process"""
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+    for index in range(workers):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def run_worker(index, shard_ids, shard_count):
+    """Entry point of a worker process: run an AutoShardedBot for its shard range"""
+    # The audio cache index is not shared between processes, so each worker gets its own directory
+    if os.getenv("AUDIO_CACHE_DIR"):
+        os.environ["AUDIO_CACHE_DIR"] = os.path.join(os.environ["AUDIO_CACHE_DIR"], f"worker-{index}")
+    # Each worker serves its metrics on its own port
+    if os.getenv("METRICS_PORT"):
+        os.environ["METRICS_PORT"] = str(int(os.environ["METRICS_PORT"]) + index)
+
+    # Imported here so every process builds its own bot, players and resolver
+    from main import create_bot
+
+    # Only the worker that owns shard 0 syncs slash commands
+    bot = create_bot(shard_ids=shard_ids, shard_count=shard_count, sync_commands=0 in shard_ids)
+    bot.run(bot_token)
+
+
+def start_worker(context, index, shard_ids, shard_count):
+    process = context.Process(target=run_worker, args=(index, shard_ids, shard_count),
+                              name=f"shards-{shard_ids[0]}-{shard_ids[-1]}")
+    process.start()
+    print(f"Started worker {index} (pid {process.pid}) for shards {shard_ids[0]}-{shard_ids[-1]}")
+    return process
+
+
+def main():
+    if not bot_token:
+        raise ValueError("Missing DISCORD_BOT_TOKEN environment variable")
+
+    shard_count = int(shard_count_env) if shard_count_env else recommended_shard_count(bot_token)
+    shard_ranges = split_shards(shard_count, worker_processes)
+    print(f"Running {shard_count} shards across {len(shard_ranges)} worker processes")
+
+    # Spawn keeps workers from inheriting any state from this process
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for index, shard_ids in enumerate(shard_ranges):
+        if index:
+            time.sleep(IDENTIFY_INTERVAL * len(shard_ranges[index - 1]))
+        processes.append(start_worker(context, index, shard_ids, shard_count))
+
+    # Restart workers that crash, stop everything on Ctrl+C
+    try:
+        while True:
+            time.sleep(RESTART_DELAY)
+            for index, process in enumerate(processes):
+                if process.exitcode is not None:
+                    print(f"Worker {index} exited with code {process.exitcode}, restarting")
+                    processes[index] = start_worker(context, index, shard_ranges[index], shard_count)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
 import discord
 from discord.ext import commands
-from music_player import MusicPlayer
+from player_registry import PlayerRegistry
 from bot_commands import BotCommands
+from resolver import get_resolver
+from metrics import (start_metrics_server, monitor_event_loop, QUEUE_DEPTH, PLAYERS, PLAYERS_BY_STATE,
+                     PLAYERS_EVICTED, CACHE_ENTRIES, CACHE_EVENTS, EXTRACTION_QUEUED, EXTRACTION_BACKOFF)
 import dotenv
 import os
+import json
+import asyncio
+import hashlib
 
 # Load environment variables from .env file
 dotenv.load_dotenv()
@@ -13,47 +19,137 @@ bot_token = os.getenv("DISCORD_BOT_TOKEN")
 if not bot_token:
     raise ValueError("Missing DISCORD_BOT_TOKEN environment variable")
 
-# Set up the bot with required intents
-intents = discord.Intents.default()
-intents.message_content = True
-intents.voice_states = True
-intents.guilds = True
+# Hash of the last command tree synced to Discord, syncing is skipped while it still matches
+command_hash_path = os.getenv("COMMAND_HASH_PATH", ".command_tree_hash")
 
-# Create bot instance
-bot = commands.Bot(command_prefix="mao!", intents=intents)
 
-# Create a dictionary to store music players for each guild
-music_players = {}
+def command_tree_hash(bot):
+    """Hash the registered slash commands as they would be sent to Discord"""
+    payload = []
+    for command in sorted(bot.tree.get_commands(), key=lambda command: command.name):
+        try:
+            payload.append(command.to_dict(bot.tree))
+        except TypeError:
+            # discord.py before 2.4 takes no tree argument
+            payload.append(command.to_dict())
+    data = json.dumps([bot.application_id, payload], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
 
 
-# Event for when the bot is ready
-@bot.event
-async def on_ready():
-    print(f'Logged in as {bot.user}')
+def read_command_hash(path=command_hash_path):
     try:
-        # Global sync for all commands
-        synced = await bot.tree.sync()
-        print(f"Synced {len(synced)} commands globally.")
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
 
-        # Remove the guild-specific sync to avoid permission conflicts
-    except Exception as e:
-        print(f"Error syncing commands: {e}")
 
+def write_command_hash(value, path=command_hash_path):
+    try:
+        with open(path, 'w') as f:
+            f.write(value + "\n")
+    except OSError as e:
+        print(f"Error saving command hash: {e}")
+
+
+def cache_entries():
+    """Entries per cache, the audio cache counts files"""
+    return {cache: stats.get('size', stats.get('files', 0)) for cache, stats in get_resolver().cache_stats().items()}
+
+
+def cache_events():
+    """Hit, miss, expiration and eviction counters per cache"""
+    return {(cache, event): value for cache, stats in get_resolver().cache_stats().items()
+            for event, value in stats.items() if event not in ('size', 'files', 'bytes')}
+
+
+def extraction_queued():
+    """Jobs waiting in the scheduler per guild, work not charged to a guild counts as shared"""
+    scheduler = get_resolver().scheduler
+    return {guild if guild is not None else "shared": scheduler.guild_stats(guild)['queued']
+            for guild in list(scheduler.guilds)}
+
+
+def create_bot(shard_ids=None, shard_count=None, sync_commands=True):
+    """Build the bot and register its commands, sharded when a shard count is given"""
+    # Set up the bot with required intents
+    intents = discord.Intents.default()
+    # Every command is a slash command or component, so message events are not needed at all
+    intents.messages = False
+    intents.voice_states = True
+    intents.guilds = True
+
+    # Create bot instance, each process only runs the shards it was given
+    if shard_count:
+        bot = commands.AutoShardedBot(command_prefix="mao!", intents=intents,
+                                      shard_ids=shard_ids, shard_count=shard_count)
+    else:
+        bot = commands.Bot(command_prefix="mao!", intents=intents)
+
+    # Music players for each guild, idle ones are evicted after PLAYER_IDLE_TIMEOUT seconds
+    music_players = PlayerRegistry(bot)
+    bot.music_players = music_players
+
+    # Gauges read from the live players whenever the metrics endpoint is scraped
+    QUEUE_DEPTH.set_function(lambda: sum(len(player.queue) for player in music_players.players.values()))
+    PLAYERS.set_function(lambda: len(music_players))
+    PLAYERS_BY_STATE.set_function(lambda: {state: count for state, count in music_players.stats().items()
+                                           if state != 'evicted'})
+    PLAYERS_EVICTED.set_function(lambda: music_players.evicted)
+    CACHE_ENTRIES.set_function(cache_entries)
+    CACHE_EVENTS.set_function(cache_events)
+    EXTRACTION_QUEUED.set_function(extraction_queued)
+    EXTRACTION_BACKOFF.set_function(lambda: get_resolver().scheduler.stats()['backoff_remaining'])
+
+    # Event for when the bot is ready
+    @bot.event
+    async def on_ready():
+        print(f'Logged in as {bot.user} (shards: {shard_ids if shard_ids is not None else "all"})')
+
+        # on_ready fires again after reconnects, only start the metrics endpoint once
+        if not hasattr(bot, 'metrics_server'):
+            bot.metrics_server = None
+            bot.loop_monitor = asyncio.create_task(monitor_event_loop())
+            try:
+                bot.metrics_server = await start_metrics_server()
+            except OSError as e:
+                print(f"Error starting metrics endpoint: {e}")
+
+        # Load yt_dlp in the background now that the bot is up
+        get_resolver().warm_up()
+
+        # Reconnects fire on_ready again, the commands only need checking once per process
+        if not sync_commands or getattr(bot, 'commands_checked', False):
+            return
+        bot.commands_checked = True
+
+        tree_hash = command_tree_hash(bot)
+        if tree_hash == read_command_hash():
+            print("Commands unchanged since the last sync, skipping sync.")
+            return
+        try:
+            # Global sync for all commands
+            synced = await bot.tree.sync()
+            print(f"Synced {len(synced)} commands globally.")
+            write_command_hash(tree_hash)
+
+            # Remove the guild-specific sync to avoid permission conflicts
+        except Exception as e:
+            print(f"Error syncing commands: {e}")
+
+    # Get or create music player for a guild
+    def get_music_player(guild):
+        return music_players.get(guild)
 
-# Get or create music player for a guild
-def get_music_player(guild):
-    guild_id = guild.id
-    if guild_id not in music_players:
-        music_players[guild_id] = MusicPlayer(bot, guild)
-    return music_players[guild_id]
+    # Initialize the commands handler
+    commands_handler = BotCommands(bot, get_music_player)
 
+    # Add the commands to the bot
+    commands_handler.setup()
 
-# Initialize the commands handler
-commands_handler = BotCommands(bot, get_music_player)
+    return bot
 
-# Add the commands to the bot
-commands_handler.setup()
 
 # Run the bot
 if __name__ == "__main__":
-    bot.run(bot_token)  # Use the token from environment variables
\ No newline at end of file
+    create_bot().run(bot_token)  # Use the token from environment variables
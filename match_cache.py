@@ -0,0 +1,94 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+
+match_cache_path = os.getenv("MATCH_CACHE_PATH", "match_cache.sqlite3")
+match_cache_ttl = int(os.getenv("MATCH_CACHE_TTL", str(30 * 24 * 3600)))
+match_cache_size = int(os.getenv("MATCH_CACHE_SIZE", "200000"))
+
+# Prune expired and excess rows after this many writes instead of on every insert
+PRUNE_INTERVAL = 500
+
+
+def normalize_query(query):
+    """Lower-case a search query and collapse punctuation and whitespace"""
+    return " ".join(re.sub(r"[^\w\s]", " ", query.casefold()).split())
+
+
+class MatchCache:
+    """SQLite-backed map from Spotify track IDs and search queries to chosen YouTube videos"""
+
+    def __init__(self, path=match_cache_path, ttl=match_cache_ttl, max_entries=match_cache_size):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        # Workers from the resolver pool share one connection guarded by the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS matches ("
+                "key TEXT PRIMARY KEY, video_id TEXT NOT NULL, title TEXT, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS matches_accessed ON matches (accessed_at)")
+
+    @staticmethod
+    def spotify_key(track_id):
+        return f"spotify:{track_id}"
+
+    @staticmethod
+    def query_key(query):
+        return f"query:{normalize_query(query)}"
+
+    def get(self, key):
+        """Return (video_id, title) for a key, or None if it is missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT video_id, title, expires_at FROM matches WHERE key = ?", (key,)).fetchone()
+            if row is None or row[2] <= now:
+                self.misses += 1
+                return None
+
+            with self._conn:
+                self._conn.execute("UPDATE matches SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0], row[1]
+
+    def put(self, key, video_id, title=None):
+        """Remember the YouTube video chosen for a key"""
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO matches (key, video_id, title, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)", (key, video_id, title, now + self.ttl, now))
+            self._writes += 1
+            if self._writes % PRUNE_INTERVAL == 0:
+                self._prune(now)
+
+    def _prune(self, now):
+        """Drop expired rows, then the least recently used ones beyond the size cap"""
+        with self._conn:
+            self._conn.execute("DELETE FROM matches WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                "DELETE FROM matches WHERE key IN ("
+                "SELECT key FROM matches ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def stats(self):
+        """Return hit/miss counters and the number of stored matches"""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM matches").fetchone()[0]
+        return {'size': size, 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,253 @@
+import os
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+
+metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+metrics_port = os.getenv("METRICS_PORT")  # Endpoint disabled when unset
+
+# Upper bounds in seconds, from cache hits up to slow playlist loads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    inner = ",".join(f'{name}="{str(value)}"' for name, value in pairs)
+    return "{" + inner + "}"
+
+
+class Metric:
+    """Base for labelled metrics rendered in the Prometheus text format"""
+
+    type_name = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._function = None
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def set_function(self, function):
+        """Read the value from a callback at scrape time instead of recording it. For labelled metrics the
+        callback returns a dict of label values (a tuple, or one value for a single label) -> value"""
+        self._function = function
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        if self._function is not None:
+            try:
+                value = self._function()
+                if isinstance(value, dict):
+                    for key, sample in value.items():
+                        key = key if isinstance(key, tuple) else (key,)
+                        lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {sample}")
+                else:
+                    lines.append(f"{self.name} {value}")
+            except Exception as e:
+                print(f"Error reading metric {self.name}: {str(e)}")
+        else:
+            lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[-1] if state else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        lines = []
+        for key, state in items:
+            for bound, bucket_count in zip(self.buckets, state):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bound)])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics exposed on the metrics endpoint"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "musicbot_stage_seconds", "Time spent in each resolution and playback stage", ["stage"]))
+TIME_TO_FIRST_AUDIO = REGISTRY.register(Histogram(
+    "musicbot_time_to_first_audio_seconds",
+    "Time from a /play request (play) or the end of the previous song (play_next) until audio starts", ["path"]))
+SOURCES = REGISTRY.register(Counter(
+    "musicbot_sources_total", "FFmpeg sources opened, by audio path", ["path"]))
+RESOLUTION_ERRORS = REGISTRY.register(Counter(
+    "musicbot_resolution_errors_total", "Tracks that could not be resolved", ["stage"]))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "musicbot_queue_depth", "Tracks queued across all players"))
+PLAYERS = REGISTRY.register(Gauge(
+    "musicbot_players", "Music players in memory"))
+PLAYERS_BY_STATE = REGISTRY.register(Gauge(
+    "musicbot_players_by_state", "Music players with (live) and without (idle) a voice connection", ["state"]))
+PLAYERS_EVICTED = REGISTRY.register(Counter(
+    "musicbot_players_evicted_total", "Idle music players closed by the registry"))
+CACHE_ENTRIES = REGISTRY.register(Gauge(
+    "musicbot_cache_entries", "Entries held by the stream, match and audio caches", ["cache"]))
+CACHE_EVENTS = REGISTRY.register(Counter(
+    "musicbot_cache_events_total", "Cache hits, misses, expirations and evictions", ["cache", "event"]))
+RESOLVER_WORKERS = REGISTRY.register(Gauge(
+    "musicbot_resolver_workers", "Size of the shared resolver pool"))
+RESOLVER_BUSY = REGISTRY.register(Gauge(
+    "musicbot_resolver_busy", "Resolver workers currently running a job"))
+RESOLVER_PENDING = REGISTRY.register(Gauge(
+    "musicbot_resolver_pending", "Resolver jobs submitted but not yet finished, including running ones"))
+RESOLVER_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "musicbot_resolver_wait_seconds", "Time a resolver job waited for a free worker"))
+COALESCED = REGISTRY.register(Counter(
+    "musicbot_coalesced_requests_total", "Requests that shared an identical in-flight resolution", ["kind"]))
+EXTRACTION_LIMIT = REGISTRY.register(Gauge(
+    "musicbot_extraction_limit", "Current adaptive limit on concurrent extractions"))
+EXTRACTION_IN_FLIGHT = REGISTRY.register(Gauge(
+    "musicbot_extraction_in_flight", "Extractions started by the scheduler and not yet finished"))
+EXTRACTION_QUEUED = REGISTRY.register(Gauge(
+    "musicbot_extraction_queued", "Extractions waiting in the scheduler, per guild", ["guild"]))
+EXTRACTION_BACKOFF = REGISTRY.register(Gauge(
+    "musicbot_extraction_backoff_seconds", "Time left before the scheduler starts jobs again after a rate limit"))
+EXTRACTION_RETRIES = REGISTRY.register(Counter(
+    "musicbot_extraction_retries_total", "Failed extractions queued again for another attempt"))
+RATE_LIMITED = REGISTRY.register(Counter(
+    "musicbot_rate_limited_total", "Extractions rejected by YouTube or Spotify rate limiting"))
+SCHEDULER_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "musicbot_scheduler_wait_seconds", "Time a job waited in the extraction scheduler", ["priority"]))
+PLAYBACK_STALLS = REGISTRY.register(Counter(
+    "musicbot_playback_stalls_total", "Songs that stalled, ended early or lost their voice connection", ["reason"]))
+PLAYBACK_RECOVERIES = REGISTRY.register(Counter(
+    "musicbot_playback_recoveries_total", "Attempts to resume a song at its position, by outcome", ["result"]))
+EVENT_LOOP_LAG = REGISTRY.register(Histogram(
+    "musicbot_event_loop_lag_seconds", "How late the event loop woke up from a short sleep",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)))
+GUILD_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "musicbot_guild_wait_seconds", "Time a guild's jobs waited in the extraction scheduler", ["guild"]))
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Observe the time spent inside the block, also around awaits"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, **labels)
+
+
+async def monitor_event_loop(interval=0.25, samples=None):
+    """Record event loop lag until cancelled, also appending to `samples` when given"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - start - interval)
+        EVENT_LOOP_LAG.observe(lag)
+        if samples is not None:
+            samples.append(lag)
+
+
+async def _handle_request(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Drain the headers, the request body is never used
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", REGISTRY.render().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host=metrics_host, port=metrics_port):
+    """Serve /metrics on a local port, returns None when no port is configured"""
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle_request, host, int(port))
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
@@ -1,39 +1,51 @@
 import dotenv
 import discord
-import yt_dlp
-import random
-from spotipy import Spotify
-from spotipy.oauth2 import SpotifyClientCredentials
 import os
 import asyncio
-import concurrent.futures
-from functools import partial
+import time
+from resolver import get_resolver, SEARCH_FLAT_OPTS, PLAYLIST_FLAT_OPTS
+from scheduler import INTERACTIVE, BULK
+from track_queue import Track, TrackQueue
+from state_store import get_state_saver
+from match_cache import normalize_query
+from playback_watchdog import TrackedSource, PlaybackWatchdog
+from stream_cache import stream_expiry
+from url_router import (MediaRef, parse_ref, YOUTUBE_VIDEO, YOUTUBE_PLAYLIST, SPOTIFY_TRACK, SPOTIFY_ALBUM,
+                        SPOTIFY_PLAYLIST, LINK, UNSUPPORTED, UNSUPPORTED_MESSAGE)
+from metrics import (timed, STAGE_SECONDS, TIME_TO_FIRST_AUDIO, SOURCES, RESOLUTION_ERRORS, PLAYBACK_STALLS,
+                     PLAYBACK_RECOVERIES)
 
 dotenv.load_dotenv()
 
-client = os.getenv("SPOTIFY_CLIENT")
-secret = os.getenv("SPOTIFY_SECRET")
 ffmpeg = os.getenv("FFMPEG_PATH")
+prefetch_ahead = int(os.getenv("PREFETCH_AHEAD", "2"))
+prebuffer_seconds = float(os.getenv("PREBUFFER_SECONDS", "5"))
+search_prefetch = int(os.getenv("SEARCH_PREFETCH", "3"))  # /search results resolved while the user chooses
+max_queue_length = int(os.getenv("GUILD_MAX_QUEUE_LENGTH", "5000"))
+ingest_rate = float(os.getenv("GUILD_INGEST_RATE", "50"))  # Playlist songs queued per second, 0 for no limit
+# A playlist's first songs are resolved in parallel while it loads, so unavailable ones are reported up front
+playlist_check_ahead = int(os.getenv("PLAYLIST_CHECK_AHEAD", "20"))
+playlist_check_concurrency = int(os.getenv("PLAYLIST_CHECK_CONCURRENCY", "4"))  # 0 turns the checks off
+
+# Fields requested per Spotify playlist page, everything else is left out of the response
+SPOTIFY_PLAYLIST_FIELDS = "items(track(id,name,duration_ms,artists(name))),next,total"
 
 
 class MusicPlayer:
     def __init__(self, bot, guild):
         self.bot = bot
         self.guild = guild
-        self.queue = []
-        self.titles = []
-        self.video_urls = []  # Store video URLs for reference
+        self.queue = TrackQueue()  # Tracks are resolved to streams just in time
         self.current_song = None
         self.current_video_url = None  # Track current video URL
+        self.current_track = None
         self.last_interaction = None
+        self.last_active = time.monotonic()  # Used by the registry to evict idle players
+        self.starting = False  # Set while play_next resolves the next song, so nothing else starts one
+        self.queue_epoch = 0  # Bumped by clear_queue, so a song resolved across /stop is not started
 
-        # Create a thread pool for handling downloads
-        self.thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2)
-
-        # Initialize Spotify API
-        self.sp = Spotify(auth_manager=SpotifyClientCredentials(
-            client_id=client,
-            client_secret=secret))
+        # Shared resolver: one worker pool and Spotify client for every guild
+        self.resolver = get_resolver()
 
         # FFmpeg options for better stream handling
         self.ffmpeg_options = {
@@ -41,266 +53,353 @@ class MusicPlayer:
             'options': '-vn'
         }
 
+        # Files from the audio cache need no reconnect handling
+        self.local_ffmpeg_options = {
+            'options': '-vn'
+        }
+
         # Path to FFmpeg executable
         self.ffmpeg_path = ffmpeg
 
+        # Background resolution of the next few queued tracks
+        self.prefetch_ahead = prefetch_ahead
+        self.prefetch_tasks = {}
+
+        # Playlists still loading in the background, mapped to their progress
+        self.ingest_tasks = {}
+
+        # Per-guild limits so one server's huge playlist cannot crowd out the others
+        self.max_queue_length = max_queue_length
+        self.ingest_rate = ingest_rate
+        self.playlist_check_ahead = playlist_check_ahead
+        self.playlist_check_concurrency = playlist_check_concurrency
+
+        # Playback position of the current song, used to pre-buffer the next one
+        self.current_duration = None
+        self.playback_started_at = None
+        self.paused_at = None
+        self.paused_total = 0.0
+        self.start_offset = 0  # Where the current song's FFmpeg source started (-ss)
+
+        # Frame-counting wrapper around the playing source, and the watchdog that restarts it when it stalls
+        self.tracked_source = None
+        self.current_entry = None
+        self.playback_generation = 0  # Bumped per started source, so a replaced source's callback is ignored
+        self.recovery_attempts = 0
+        self.watchdog = PlaybackWatchdog(self)
+        self.playback_stats = {'stalls': 0, 'recoveries': 0, 'voice_drops': 0}
+
+        # Next song's already opened source as (track, entry, source), for gapless transitions
+        self.prebuffer_seconds = prebuffer_seconds
+        self.prebuffer = None
+        self.prebuffer_task = None
+        self.prebuffer_handle = None
+
+        # Queue snapshots for restart recovery, nothing is saved until the saved state was restored
+        self.state_saver = get_state_saver(self.resolver)
+        self.state_loaded = False
+        self.saved_queue_version = None
+        self.saved_queue_layout = None
+        self.saved_seqs = set()  # Sequence numbers of the queued tracks as last saved
+        self.playback_saved = False
+
     async def search_song(self, query, limit=5):
         """Search for songs and return a list of options"""
 
         def _search():
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'noplaylist': 'True',
-                'quiet': True,
-                'extract_flat': True,
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(f"ytsearch{limit}:{query}", download=False)
-                results = []
-                for entry in info['entries']:
-                    results.append({
-                        'url': f"https://www.youtube.com/watch?v={entry['id']}",
-                        'title': entry['title']
-                    })
-                return results
-
-        # Run in thread pool to avoid blocking
-        return await asyncio.get_event_loop().run_in_executor(self.thread_pool, _search)
-
-    async def get_youtube_url(self, query):
-        """Helper function to get YouTube URL from Spotify link or search query"""
-
-        def _get_url():
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'noplaylist': 'True',
-                'quiet': True,
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(f"ytsearch:{query}", download=False)
-                return info['entries'][0]['url'], info['entries'][0]['title'], info['entries'][0]['webpage_url']
-
-        # Run in thread pool to avoid blocking
-        return await asyncio.get_event_loop().run_in_executor(self.thread_pool, _get_url)
+            results = []
+            for entry in self.resolver.extract_flat(f"ytsearch{limit}:{query}", SEARCH_FLAT_OPTS):
+                results.append({
+                    'url': f"https://www.youtube.com/watch?v={entry['id']}",
+                    'title': entry['title']
+                })
+            return results
+
+        # Run on the shared resolver pool to avoid blocking
+        with timed(STAGE_SECONDS, stage="search_song"):
+            return await self.resolver.coalesce(('search', limit, normalize_query(query)), _search,
+                                                guild=self.guild.id)
 
     async def get_youtube_playlist(self, url):
         """Extract songs from a YouTube playlist"""
 
         def _get_playlist():
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'quiet': True,
-                'extract_flat': True,
-                'force_generic_extractor': False
-            }
-
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                tracks = []
-
-                # Check if it's a playlist or just a single video
-                if 'entries' in info:
-                    for entry in info['entries']:
-                        if entry:
-                            video_url = f"https://www.youtube.com/watch?v={entry['id']}"
-
-                            # Extract the stream URL for each video
-                            try:
-                                with yt_dlp.YoutubeDL(ydl_opts) as ydl2:
-                                    video_info = ydl2.extract_info(video_url, download=False)
-                                    stream_url = video_info['url']
-                                    title = entry.get('title', video_info.get('title', 'Unknown title'))
-                                    tracks.append({
-                                        'stream_url': stream_url,
-                                        'video_url': video_url,
-                                        'title': title
-                                    })
-                            except Exception as e:
-                                print(f"Error processing playlist item: {str(e)}")
-                                continue
-
-                return tracks
-
-        # Run in thread pool to avoid blocking
-        return await asyncio.get_event_loop().run_in_executor(self.thread_pool, _get_playlist)
-
-    async def process_playlist(self, interaction, url):
-        """Process a playlist URL and add all songs to the queue"""
-        try:
+            # Flat extraction only lists the entries, stream URLs are resolved when a track is about to play
             tracks = []
-            if "youtube.com/playlist" in url or "youtube.com/watch" in url and "list=" in url:
-                # YouTube playlist
-                await interaction.followup.send("Processing YouTube playlist... This may take a moment.")
-
-                # Process tracks in batches to avoid long blocking operations
-                tracks = await self.get_youtube_playlist(url)
-
-                # Add each track to the queue
-                added_count = 0
-                for track in tracks:
-                    try:
-                        self.queue.append(track['stream_url'])
-                        self.titles.append(track['title'])
-                        if not hasattr(self, 'video_urls'):
-                            self.video_urls = []
-                        self.video_urls.append(track['video_url'])
-                        added_count += 1
-                    except Exception as e:
-                        print(f"Error adding YouTube playlist track: {str(e)}")
-
-                await interaction.followup.send(f"Added {added_count} songs from YouTube playlist to the queue.")
-
-            elif "spotify.com/playlist/" in url or "spotify.com/album/" in url:
-                # Spotify playlist or album
-                await interaction.followup.send("Processing Spotify playlist... This may take a moment.")
-                spotify_tracks = await self.get_spotify_playlist(url)
-
-                # Process tracks in smaller batches
-                batch_size = 5
-                batches = [spotify_tracks[i:i + batch_size] for i in range(0, len(spotify_tracks), batch_size)]
-
-                total_added = 0
-                for i, batch in enumerate(batches):
-                    if i > 0 and i % 2 == 0:  # Update progress every few batches
-                        await interaction.followup.send(
-                            f"Progress: {total_added}/{len(spotify_tracks)} songs processed...")
-
-                    # Process each batch concurrently
-                    tasks = []
-                    for track in batch:
-                        task = asyncio.create_task(self.process_url(track['query']))
-                        tasks.append(task)
-
-                    # Wait for all tasks in batch to complete
-                    results = await asyncio.gather(*tasks, return_exceptions=True)
-
-                    # Add successful results to queue
-                    for result in results:
-                        if isinstance(result, Exception):
-                            continue
-
-                        try:
-                            stream_url, title, video_url = result
-                            self.queue.append(stream_url)
-                            self.titles.append(title)
-                            if not hasattr(self, 'video_urls'):
-                                self.video_urls = []
-                            self.video_urls.append(video_url)
-                            total_added += 1
-                        except Exception as e:
-                            print(f"Error adding Spotify track to queue: {str(e)}")
-
-                await interaction.followup.send(f"Added {total_added} songs from Spotify playlist/album to the queue.")
-
-            # Start playing if not already playing
-            voice_client = interaction.guild.voice_client
-            if voice_client and not (voice_client.is_playing() or voice_client.is_paused()) and self.queue:
-                await self.play_next()
-
-            return True
 
-        except Exception as e:
-            await interaction.followup.send(f"Error processing playlist: {str(e)}")
-            return False
+            # A single video has no entries and lists nothing
+            for entry in self.resolver.extract_flat(url, PLAYLIST_FLAT_OPTS):
+                tracks.append({
+                    'video_url': f"https://www.youtube.com/watch?v={entry['id']}",
+                    'video_id': entry['id'],
+                    'title': entry.get('title') or 'Unknown title',
+                    'duration': entry.get('duration')
+                })
 
-    async def get_spotify_playlist(self, url):
-        """Extract songs from a Spotify playlist"""
+            return tracks
 
-        def _get_spotify_playlist():
-            # Extract playlist ID from URL
-            tracks = []
+        # Run on the shared resolver pool to avoid blocking
+        with timed(STAGE_SECONDS, stage="get_youtube_playlist"):
+            return await self.resolver.coalesce(('youtube_playlist', url), _get_playlist, priority=BULK,
+                                                guild=self.guild.id)
 
-            if "playlist" in url:
-                playlist_id = url.split("playlist/")[1].split("?")[0]
-                results = self.sp.playlist_items(playlist_id)
+    async def iter_youtube_playlist(self, url, progress=None):
+        """Yield songs from a YouTube playlist once its flat listing is available"""
+        tracks = await self.get_youtube_playlist(url)
+        if progress is not None:
+            progress['total'] = len(tracks)
+        for track in tracks:
+            yield Track(track['video_url'], track['title'], video_id=track['video_id'], duration=track['duration'])
 
-                # Process each track in the playlist
-                for item in results['items']:
-                    track = item['track']
-                    if track:
-                        query = f"{track['name']} {track['artists'][0]['name']}"
-                        tracks.append({'query': query})
+    async def process_playlist(self, interaction, url):
+        """Start loading a playlist into the queue in the background, playing the first song as soon as it is queued"""
+        progress = {'added': 0, 'total': None, 'checked': 0, 'failed': []}
+        ref = parse_ref(url)
+        if ref.kind == YOUTUBE_PLAYLIST:
+            # YouTube playlist, also when opened from one of its videos
+            await interaction.followup.send("Processing YouTube playlist... This may take a moment.")
+            progress['label'] = "YouTube playlist"
+            tracks = self.iter_youtube_playlist(ref.url, progress)
+
+        elif ref.kind in (SPOTIFY_PLAYLIST, SPOTIFY_ALBUM):
+            # Spotify playlist or album
+            await interaction.followup.send("Processing Spotify playlist... This may take a moment.")
+            progress['label'] = "Spotify playlist/album"
+            tracks = self.iter_spotify_playlist(ref.url, progress)
 
-            # Extract album if it's an album URL
-            elif "album" in url:
-                album_id = url.split("album/")[1].split("?")[0]
-                results = self.sp.album_tracks(album_id)
+        else:
+            await interaction.followup.send("That doesn't look like a playlist URL.")
+            return False
 
-                # Process each track in the album
-                for track in results['items']:
-                    if track:
-                        query = f"{track['name']} {track['artists'][0]['name']}"
-                        tracks.append({'query': query})
+        # Keep loading in the background, /stop and /leave cancel it through clear_queue
+        requester = getattr(interaction.user, 'display_name', None)
+        task = asyncio.create_task(self._ingest_playlist(interaction, tracks, progress, requester))
+        self.ingest_tasks[task] = progress
+        task.add_done_callback(lambda done: self.ingest_tasks.pop(done, None))
+        return True
+
+    async def _ingest_playlist(self, interaction, tracks, progress, requester=None):
+        """Queue playlist songs as they arrive, starting playback as soon as there is something to play"""
+        started = time.monotonic()
+        checks = []
+        # No concurrency means no checks, a semaphore without slots would never let one run
+        check_ahead = self.playlist_check_ahead if self.playlist_check_concurrency > 0 else 0
+        check_slots = asyncio.Semaphore(max(1, self.playlist_check_concurrency))
+        try:
+            async for track in tracks:
+                if self.queue_full():
+                    await interaction.followup.send(
+                        f"The queue is full ({self.max_queue_length} songs), stopped loading {progress['label']} "
+                        f"after {progress['added']} songs.")
+                    return
+
+                # Queue the video URL or Spotify link, streams are resolved just in time
+                track.requester = requester
+                self.queue.append(track)
+                progress['added'] += 1
+                if progress['added'] <= check_ahead:
+                    checks.append(asyncio.create_task(self._check_track(track, progress, check_slots)))
+
+                # Start playing if not already playing
+                voice_client = self.guild.voice_client
+                if voice_client and not (voice_client.is_playing() or voice_client.is_paused() or self.starting):
+                    await self.play_next()
+                elif len(self.queue) <= self.prefetch_ahead:
+                    self.schedule_prefetch()
+
+                if self.ingest_rate:
+                    # Pace the listing after a one second burst, later pages are only fetched as songs are queued
+                    delay = started + progress['added'] / self.ingest_rate - 1 - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+            # Wait for the checks so songs that cannot be played are reported with the summary
+            await asyncio.gather(*checks)
+            message = f"Added {progress['added']} songs from {progress['label']} to the queue."
+            if progress['failed']:
+                skipped = ", ".join(progress['failed'][:10])
+                more = f" and {len(progress['failed']) - 10} more" if len(progress['failed']) > 10 else ""
+                message += f" Skipped {len(progress['failed'])} unavailable: {skipped}{more}."
+            await interaction.followup.send(message)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await interaction.followup.send(f"Error processing playlist: {str(e)}")
+        finally:
+            for check in checks:
+                check.cancel()
+            # Close the source generator now rather than whenever it is garbage collected
+            await tracks.aclose()
+
+    async def _check_track(self, track, progress, slots):
+        """Resolve a playlist song ahead of time, dropping it from the queue if it cannot be played"""
+        async with slots:
+            if track.state != Track.PENDING or track is self.current_track:
+                return  # Already resolved by play_next or a prefetch
+            try:
+                entry = await self.resolve_entry(track.source, BULK)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                track.state = Track.FAILED
+                RESOLUTION_ERRORS.inc(stage="playlist_check")
+                print(f"Error checking {track}: {str(e)}")
+                progress['failed'].append(track.title)
+                self.queue.remove(track)
+                return
+            track.video_id = entry.get('video_id') or track.video_id
+            track.duration = track.duration or entry.get('duration')
+            track.state = Track.RESOLVED
+            progress['checked'] += 1
+
+    def queue_full(self):
+        return len(self.queue) >= self.max_queue_length
+
+    def cancel_ingest(self):
+        """Cancel every playlist that is still loading"""
+        for task in list(self.ingest_tasks):
+            task.cancel()
+        self.ingest_tasks.clear()
+
+    async def iter_spotify_playlist(self, url, progress=None):
+        """Yield songs from a Spotify playlist or album page by page, following every next link"""
+        sp = self.resolver.sp
+        ref = parse_ref(url)
+
+        if ref.kind == SPOTIFY_PLAYLIST:
+            playlist_id = ref.id
+            # Only ask Spotify for the fields we actually use
+            with timed(STAGE_SECONDS, stage="spotify_page"):
+                results = await self.resolver.coalesce(
+                    ('spotify_playlist', playlist_id), sp.playlist_items, playlist_id,
+                    fields=SPOTIFY_PLAYLIST_FIELDS, limit=100, additional_types=('track',), priority=BULK,
+                    guild=self.guild.id)
+            get_track = lambda item: item['track']  # noqa: E731
+
+        # Extract album if it's an album URL
+        elif ref.kind == SPOTIFY_ALBUM:
+            album_id = ref.id
+            with timed(STAGE_SECONDS, stage="spotify_page"):
+                results = await self.resolver.coalesce(('spotify_album', album_id), sp.album_tracks, album_id,
+                                                       limit=50, priority=BULK, guild=self.guild.id)
+            get_track = lambda item: item  # noqa: E731
 
-            return tracks
+        else:
+            return
 
-        # Run in thread pool to avoid blocking
-        return await asyncio.get_event_loop().run_in_executor(self.thread_pool, _get_spotify_playlist)
-
-    async def process_url(self, url):
-        """Process the URL to get a playable YouTube URL and title"""
-
-        def _process_url():
-            # Handle Spotify track links
-            if "spotify.com/track/" in url:
-                track_id = url.split("track/")[1].split("?")[0]
-                track_info = self.sp.track(track_id)
-                query = f"{track_info['name']} {track_info['artists'][0]['name']}"
-                # Convert to a YouTube search
-                ydl_opts = {
-                    'format': 'bestaudio/best',
-                    'noplaylist': 'True',
-                    'quiet': True,
-                }
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(f"ytsearch:{query}", download=False)
-                    video_info = info['entries'][0]
-                    # Get the actual stream URL
-                    stream_url = video_info['url']
-                    title = video_info['title']
-                    return stream_url, title, video_info['webpage_url']  # Return stream URL, title, and video page URL
-
-            # Handle direct YouTube URLs
-            elif "youtube.com/" in url or "youtu.be/" in url:
-                ydl_opts = {
-                    'format': 'bestaudio/best',
-                    'noplaylist': 'False',  # Allow playlists
-                    'quiet': True,
-                }
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    if '_type' in info and info['_type'] == 'playlist':
-                        # This is a playlist, but we're just getting the first item for now
-                        entry = info['entries'][0]
-                        stream_url = entry['url']  # This is the actual playable stream URL
-                        title = entry['title']
-                        video_url = entry['webpage_url']  # Original video URL
-                    else:
-                        stream_url = info['url']  # This is the actual playable stream URL
-                        title = info['title']
-                        video_url = info['webpage_url'] if 'webpage_url' in info else url  # Original video URL
-                return stream_url, title, video_url
+        if progress is not None:
+            progress['total'] = results.get('total')
+
+        while results:
+            for item in results['items']:
+                track = get_track(item) if item else None
+                if track:
+                    yield self._spotify_track_info(track)
+
+            # Fetch the next page only once this one has been consumed
+            if not results.get('next'):
+                break
+            with timed(STAGE_SECONDS, stage="spotify_page"):
+                # Guilds loading the same playlist at once share each page
+                results = await self.resolver.coalesce(('spotify_page', results['next']), sp.next, results,
+                                                       priority=BULK, guild=self.guild.id)
+
+    @staticmethod
+    def _spotify_track_info(track):
+        """Build the queued Track for a Spotify track"""
+        artist = track['artists'][0]['name']
+        if track.get('id'):
+            # Queue the track link so its YouTube match can come from the persistent match cache
+            source = f"https://open.spotify.com/track/{track['id']}"
+        else:
+            # Local files have no Spotify ID, fall back to a plain search
+            source = f"{track['name']} {artist}"
+        duration = track['duration_ms'] / 1000 if track.get('duration_ms') else None
+        return Track(source, f"{track['name']} - {artist}", duration=duration)
+
+    async def resolve_entry(self, url, priority=INTERACTIVE):
+        """Resolve a URL, search query or MediaRef to its stream entry (stream URL, title, video URL and duration)"""
+        ref = url if isinstance(url, MediaRef) else parse_ref(url)
+        if ref.kind == UNSUPPORTED:
+            raise ValueError(UNSUPPORTED_MESSAGE)
+        if ref.kind == YOUTUBE_VIDEO:
+            # Known video ID with a live stream URL, no need to go through the pool at all
+            cached = self.resolver.cached_stream(ref.id)
+            if cached:
+                return cached
+
+        def _resolve_entry():
+            # Handle Spotify track links, the match cache skips the search for known tracks
+            if ref.kind == SPOTIFY_TRACK:
+                return self.resolver.resolve_spotify_track(ref.id)
+
+            # Handle direct YouTube URLs, repeat plays are served from the stream cache
+            elif ref.kind == YOUTUBE_VIDEO:
+                return self.resolver.extract_stream(ref.url)
+
+            # Other YouTube pages are left to yt_dlp
+            elif ref.kind == LINK:
+                return self.resolver.extract_stream(ref.query)
 
             # Handle normal search queries
             else:
-                ydl_opts = {
-                    'format': 'bestaudio/best',
-                    'noplaylist': 'True',
-                    'quiet': True,
-                }
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(f"ytsearch:{url}", download=False)
-                    video_info = info['entries'][0]
-                    # Get the actual stream URL
-                    stream_url = video_info['url']
-                    title = video_info['title']
-                    return stream_url, title, video_info['webpage_url']  # Return stream URL, title, and video page URL
-
-        # Run in thread pool to avoid blocking
-        return await asyncio.get_event_loop().run_in_executor(self.thread_pool, _process_url)
+                return self.resolver.search_stream(ref.query)
+
+        # Run on the shared resolver pool to avoid blocking
+        with timed(STAGE_SECONDS, stage="process_url"):
+            return await self.resolver.coalesce(self.resolver.resolution_key(ref), _resolve_entry,
+                                                 priority=priority, guild=self.guild.id)
+
+    def _create_source(self, entry, start_at=0):
+        """Open an FFmpeg audio source for a resolved entry, passing Opus streams through without re-encoding"""
+        ffmpeg_options = self.local_ffmpeg_options if entry.get('local') else self.ffmpeg_options
+        if start_at:
+            # Seek on the input side so FFmpeg skips straight to the offset
+            ffmpeg_options = dict(ffmpeg_options)
+            ffmpeg_options['before_options'] = f"{ffmpeg_options.get('before_options', '')} -ss {start_at:.2f}".strip()
+        with timed(STAGE_SECONDS, stage="ffmpeg_source"):
+            if entry.get('acodec') == 'opus':
+                # FFmpeg only remuxes the Opus packets, discord.py sends them as-is
+                SOURCES.inc(path="opus")
+                return discord.FFmpegOpusAudio(entry['stream_url'], codec='opus', executable=self.ffmpeg_path,
+                                               **ffmpeg_options)
+
+            # Anything else is decoded to PCM and encoded to Opus by discord.py
+            SOURCES.inc(path="pcm")
+            return discord.FFmpegPCMAudio(executable=self.ffmpeg_path, source=entry['stream_url'], **ffmpeg_options)
+
+    def _start_source(self, voice_client, source, entry, start_at=0, recovering=False):
+        """Start playing a source and schedule pre-buffering of the song after it"""
+        source = TrackedSource(source, start_at)
+        self.playback_generation += 1
+        generation = self.playback_generation
+
+        def after_playing(error):
+            if error:
+                print(f"Player error: {error}")
+            # Use the bot's event loop to decide between the next song and a restart of this one
+            asyncio.run_coroutine_threadsafe(self._playback_ended(generation, source, error), self.bot.loop)
+
+        voice_client.play(source, after=after_playing)
+        self.tracked_source = source
+        self.current_entry = entry
+        if not recovering:
+            self.resolver.record_play(entry)
+            self.recovery_attempts = 0
+        self.watchdog.start()
+
+        # Track the playback position so the next song can be opened just before this one ends
+        self.current_duration = entry.get('duration')
+        self.playback_started_at = time.monotonic()
+        self.paused_at = None
+        self.paused_total = 0.0
+        self.start_offset = start_at
+        self._schedule_prebuffer()
 
     async def play(self, interaction, query):
         """Play a song or add it to the queue if something is already playing"""
+        requested_at = time.perf_counter()
         self.last_interaction = interaction
         voice_client = interaction.guild.voice_client
 
@@ -309,87 +408,349 @@ class MusicPlayer:
             return
 
         # Check if it's a playlist
-        if ("youtube.com/playlist" in query or "youtube.com/watch" in query and "list=" in query or
-                "spotify.com/playlist/" in query or "spotify.com/album/" in query):
+        ref = parse_ref(query)
+        if ref.is_playlist:
             return await self.process_playlist(interaction, query)
+        if ref.kind == UNSUPPORTED:
+            await interaction.followup.send(UNSUPPORTED_MESSAGE)
+            return
 
         try:
             # Process the URL to get the playable stream URL and title
-            await interaction.followup.send("Processing your request... This may take a moment.")
-            stream_url, title, video_url = await self.process_url(query)
+            with timed(STAGE_SECONDS, stage="followup"):
+                await interaction.followup.send("Processing your request... This may take a moment.")
+            entry = await self.resolve_entry(ref)
         except Exception as e:
             await interaction.followup.send(f"Error processing URL: {str(e)}")
             return
 
-        if voice_client.is_playing() or voice_client.is_paused():
-            # Add to queue if already playing
-            self.queue.append(stream_url)
-            self.titles.append(title)
-            self.video_urls.append(video_url)  # Store the original video URL for reference
+        title = entry['title']
+        if voice_client.is_playing() or voice_client.is_paused() or self.starting:
+            if self.queue_full():
+                await interaction.followup.send(f"The queue is full ({self.max_queue_length} songs).")
+                return
+            # Add to queue if already playing, the stream is resolved again when it is due
+            track = self._track_from_entry(entry, interaction)
+            track.start_at = ref.start
+            self.queue.append(track)
+            self.schedule_prefetch()
             await interaction.followup.send(f"Added to queue: {title}")
         else:
             # Play immediately if nothing is playing
-            self.current_song = title
-            self.current_video_url = video_url  # Store the current video URL
-
-            def after_playing(error):
-                if error:
-                    print(f"Player error: {error}")
-                # Use the bot's event loop to call the next song
-                asyncio.run_coroutine_threadsafe(self.play_next(), self.bot.loop)
-
             try:
-                voice_client.play(
-                    discord.FFmpegPCMAudio(executable=self.ffmpeg_path, source=stream_url, **self.ffmpeg_options),
-                    after=after_playing
-                )
-
+                # Links with a timestamp start from it
+                self._start_source(voice_client, self._create_source(entry, ref.start), entry, ref.start)
+                self.current_song = title
+                self.current_video_url = entry['video_url']  # Store the current video URL
+                self.current_track = self._track_from_entry(entry, interaction)
+                TIME_TO_FIRST_AUDIO.observe(time.perf_counter() - requested_at, path="play")
                 await interaction.followup.send(f"Mao is boppin' to: {title}")
             except Exception as e:
                 await interaction.followup.send(f"Error playing the song: {str(e)}")
 
+            self.schedule_prefetch()
+
     async def play_next(self):
         """Play the next song in the queue"""
+        started_at = time.perf_counter()
         voice_client = self.guild.voice_client
         if not voice_client:
+            self.discard_prebuffer()
             return
 
-        if self.queue:
+        if self.starting:
+            return  # Another call is already opening the next song
+        self.starting = True
+        epoch = self.queue_epoch
+        try:
+            await self._start_next(voice_client, started_at, epoch)
+        finally:
+            if epoch == self.queue_epoch:
+                self.starting = False  # Otherwise clear_queue released it already
+
+    async def _start_next(self, voice_client, started_at, epoch):
+        """Resolve and start the first playable queued song, play_next holds the starting flag meanwhile"""
+        while self.queue:
             # Get the next song from the queue
-            next_url = self.queue.pop(0)
-            self.current_song = self.titles.pop(0)
-            if self.video_urls:
-                self.current_video_url = self.video_urls.pop(0)
-
-            # Play it
-            def after_playing(error):
-                if error:
-                    print(f"Player error: {error}")
-                asyncio.run_coroutine_threadsafe(self.play_next(), self.bot.loop)
+            next_track = self.queue.popleft()
 
+            # Use the pre-buffered source if it was opened for this song, otherwise resolve the stream now
+            prepared = self._take_prebuffer(next_track)
+            self.discard_prebuffer()
             try:
-                voice_client.play(
-                    discord.FFmpegPCMAudio(executable=self.ffmpeg_path, source=next_url, **self.ffmpeg_options),
-                    after=after_playing
-                )
-
-                # Send a message to the channel
+                if prepared:
+                    entry, source = prepared
+                else:
+                    entry = await self.resolve_track(next_track)
+                    source = self._create_source(entry, next_track.start_at)
+            except Exception as e:
+                if epoch != self.queue_epoch:
+                    return
+                next_track.state = Track.FAILED
+                RESOLUTION_ERRORS.inc(stage="play_next")
+                print(f"Error resolving {next_track}: {str(e)}")
                 if self.last_interaction:
-                    await self.last_interaction.channel.send(f"Now playing: {self.current_song}")
+                    await self.last_interaction.channel.send(f"Skipping {next_track.title}: {str(e)}")
+                continue
+
+            if epoch != self.queue_epoch:
+                # The queue was cleared or the player stopped while the stream was resolved
+                source.cleanup()
+                return
+            if voice_client.is_playing() or voice_client.is_paused():
+                # Something else started playing while the stream was resolved, the song stays next in line
+                source.cleanup()
+                self.queue.appendleft(next_track)
+                return
+
+            # Play it
+            try:
+                self._start_source(voice_client, source, entry, next_track.start_at)
             except Exception as e:
+                source.cleanup()
                 if self.last_interaction:
                     await self.last_interaction.channel.send(f"Error playing next song: {str(e)}")
+                self.schedule_prefetch()
+                return
+
+            self.current_song = next_track.title
+            self.current_track = next_track
+            self.current_video_url = entry['video_url']
+            path = "play_next_prebuffered" if prepared else "play_next"
+            TIME_TO_FIRST_AUDIO.observe(time.perf_counter() - started_at, path=path)
+
+            # Send a message to the channel
+            if self.last_interaction:
+                await self.last_interaction.channel.send(f"Now playing: {self.current_song}")
+            self.schedule_prefetch()
+            return
+
+    async def _playback_ended(self, generation, source, error):
+        """Audio thread callback: play the next song, or resume this one if it stopped before its end"""
+        if generation != self.playback_generation:
+            return  # A recovery already replaced this source
+        self.tracked_source = None
+        voice_client = self.guild.voice_client
+        track = self.current_track
+
+        if track is not None and (voice_client is None or not voice_client.is_connected()):
+            # The voice connection dropped mid-song, keep the song at the front of the queue at its offset
+            PLAYBACK_STALLS.inc(reason="voice_drop")
+            self.playback_stats['voice_drops'] += 1
+            track.start_at = source.position
+            self.queue.appendleft(track)
+            self.discard_prebuffer()
+            self.current_track = self.current_song = self.current_entry = None
+            return
+
+        if track is not None and (error or source.ended_early(self.current_duration)):
+            await self.recover("error" if error else "ended_early", source.position)
+            return
+
+        await self.play_next()
+
+    async def recover(self, reason, position=None):
+        """Restart the current song at its position, re-resolving the stream only if its URL expired"""
+        voice_client = self.guild.voice_client
+        track, entry = self.current_track, self.current_entry
+        if voice_client is None or track is None or entry is None:
+            return False
+        if position is None:
+            position = self.playback_position()
+
+        PLAYBACK_STALLS.inc(reason=reason)
+        self.playback_stats['stalls'] += 1
+        self.recovery_attempts += 1
+        print(f"Playback of {track} stopped ({reason}) at {position:.1f}s, attempt {self.recovery_attempts}")
+
+        # Detach the old source first so its callback does not advance the queue
+        self.playback_generation += 1
+        stalled, self.tracked_source = self.tracked_source, None
+        if voice_client.is_playing() or voice_client.is_paused():
+            voice_client.stop()
+        if stalled is not None:
+            # discord.py only cleans up after its blocked read() returns, kill FFmpeg so that read ends now
+            stalled.cleanup()
+
+        if self.recovery_attempts > self.watchdog.max_recoveries:
+            PLAYBACK_RECOVERIES.inc(result="gave_up")
+            if self.last_interaction:
+                await self.last_interaction.channel.send(f"Skipping {track.title}: the stream keeps failing.")
+            await self.play_next()
+            return False
 
-    async def add_to_queue(self, url):
-        """Add a song to the queue"""
         try:
-            # Process the URL to get the playable stream URL and title
-            stream_url, title, video_url = await self.process_url(url)
+            # A repeated failure means the URL itself is bad even if it has not expired
+            fresh = await self._fresh_entry(entry, force=self.recovery_attempts > 1)
+            self._start_source(voice_client, self._create_source(fresh, position), fresh, position, recovering=True)
+        except Exception as e:
+            RESOLUTION_ERRORS.inc(stage="recover")
+            print(f"Error resuming {track}: {str(e)}")
+            await self.play_next()
+            return False
 
-            self.queue.append(stream_url)
-            self.titles.append(title)
-            self.video_urls.append(video_url)  # Store the original video URL for reference
-            return title
+        PLAYBACK_RECOVERIES.inc(result="reused" if fresh is entry else "reresolved")
+        self.playback_stats['recoveries'] += 1
+        return True
+
+    async def _fresh_entry(self, entry, force=False):
+        """Return the entry if its stream URL is still valid, otherwise resolve the same video again"""
+        if entry.get('local'):
+            return entry
+        video_id = entry.get('video_id')
+        if force:
+            if video_id:
+                self.resolver.stream_cache.invalidate(video_id)
+        elif stream_expiry(entry['stream_url']) > time.time() + 60:
+            return entry
+        # Always by video URL, never a new search
+        return await self.resolve_entry(entry['video_url'])
+
+    async def resolve_track(self, track, priority=INTERACTIVE):
+        """Resolve a queued track's stream, reusing a finished prefetch if there is one"""
+        task = self.prefetch_tasks.pop(track, None)
+        entry = None
+        if task is not None and not task.done() and priority < BULK:
+            # Joining the queued prefetch through resolve_entry moves it ahead of bulk work
+            task.cancel()
+            task = None
+        if task is not None:
+            try:
+                entry = await task
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Prefetch failed, try once more before giving up on the track
+                print(f"Prefetch failed for {track}: {str(e)}")
+        if entry is None:
+            entry = await self.resolve_entry(track.source, priority)
+
+        track.video_id = entry.get('video_id') or track.video_id
+        track.duration = track.duration or entry.get('duration')
+        track.state = Track.RESOLVED
+        return entry
+
+    @staticmethod
+    def _track_from_entry(entry, interaction=None):
+        """Build a queued Track for an already resolved entry"""
+        requester = getattr(interaction.user, 'display_name', None) if interaction else None
+        return Track(entry['video_url'], entry['title'], video_id=entry.get('video_id'),
+                     duration=entry.get('duration'), requester=requester)
+
+    def playback_position(self):
+        """Seconds into the current song, not counting pauses"""
+        if self.tracked_source is not None:
+            # Frames actually sent, which also leaves out voice reconnects and stalls
+            return self.tracked_source.position
+        if self.playback_started_at is None:
+            return 0.0
+        now = self.paused_at or time.monotonic()
+        return self.start_offset + now - self.playback_started_at - self.paused_total
+
+    def _schedule_prebuffer(self):
+        """Open the next song's source shortly before the current one is due to end"""
+        if self.prebuffer_handle:
+            self.prebuffer_handle.cancel()
+            self.prebuffer_handle = None
+        if not self.current_duration:
+            return
+
+        delay = max(0.0, self.current_duration - self.playback_position() - self.prebuffer_seconds)
+        self.prebuffer_handle = self.bot.loop.call_later(delay, self._start_prebuffer)
+
+    def _start_prebuffer(self):
+        """Timer callback that kicks off pre-buffering unless playback was paused in the meantime"""
+        self.prebuffer_handle = None
+        if self.paused_at is not None:
+            return  # resume() schedules it again
+        remaining = self.current_duration - self.playback_position()
+        if remaining > self.prebuffer_seconds + 1:
+            self._schedule_prebuffer()
+            return
+        if self.queue and self.prebuffer is None and self.prebuffer_task is None:
+            self.prebuffer_task = asyncio.create_task(self._prebuffer_next(self.queue.peek()))
+
+    async def _prebuffer_next(self, track):
+        """Resolve the next song and start its FFmpeg process so it can be swapped in without a gap"""
+        try:
+            entry = await self.resolve_track(track, BULK)
+            source = self._create_source(entry, track.start_at)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # play_next resolves it again the usual way
+            print(f"Error pre-buffering {track}: {str(e)}")
+            return
+        finally:
+            self.prebuffer_task = None
+
+        # The queue may have been skipped, shuffled or cleared while we were resolving
+        if self.queue.peek() is not track:
+            source.cleanup()
+            return
+        self.prebuffer = (track, entry, source)
+
+    def _take_prebuffer(self, track):
+        """Return the pre-buffered (entry, source) for a song, discarding it if it was opened for another one"""
+        prebuffer = self.prebuffer
+        self.prebuffer = None
+        if prebuffer is None:
+            return None
+        if prebuffer[0] is not track:
+            prebuffer[2].cleanup()
+            return None
+        return prebuffer[1], prebuffer[2]
+
+    def discard_prebuffer(self):
+        """Cancel pre-buffering and close a source that was opened but never played"""
+        if self.prebuffer_handle:
+            self.prebuffer_handle.cancel()
+            self.prebuffer_handle = None
+        if self.prebuffer_task:
+            self.prebuffer_task.cancel()
+            self.prebuffer_task = None
+        if self.prebuffer:
+            self.prebuffer[2].cleanup()
+            self.prebuffer = None
+
+    def schedule_prefetch(self):
+        """Keep the stream URLs for the next few queued tracks resolving in the background"""
+        upcoming = set(self.queue.head(self.prefetch_ahead))
+
+        # Drop prefetches for tracks that are no longer coming up (skipped, shuffled or cleared)
+        for track in list(self.prefetch_tasks):
+            if track not in upcoming:
+                self.prefetch_tasks.pop(track).cancel()
+
+        for track in upcoming:
+            if track not in self.prefetch_tasks:
+                self.prefetch_tasks[track] = asyncio.create_task(self.resolve_entry(track.source, BULK))
+
+    def prefetch_search_results(self, results, count=None):
+        """Resolve the top search results in the background so whichever is picked plays without another extraction"""
+        for result in results[:count or search_prefetch]:
+            task = asyncio.create_task(self.resolve_entry(result['url'], BULK))
+            # Nobody awaits these, a failed guess is simply resolved again if it gets picked
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+    def cancel_prefetch(self):
+        """Cancel every pending prefetch"""
+        for task in self.prefetch_tasks.values():
+            task.cancel()
+        self.prefetch_tasks.clear()
+
+    async def add_to_queue(self, url, interaction=None):
+        """Add a song to the queue"""
+        try:
+            # Process the URL to get the title and canonical video URL
+            ref = parse_ref(url)
+            entry = await self.resolve_entry(ref)
+
+            track = self._track_from_entry(entry, interaction)
+            track.start_at = ref.start  # Links with a timestamp start from it
+            self.queue.append(track)
+            self.schedule_prefetch()
+            return entry['title']
         except Exception as e:
             print(f"Error adding to queue: {str(e)}")
             return "Unknown title (error occurred)"
@@ -397,12 +758,12 @@ class MusicPlayer:
     def shuffle_queue(self):
         """Shuffle the queue"""
         if len(self.queue) > 1:
-            # Create a list of pairs (url, title, video_url) to keep them together
-            queue_triplets = list(zip(self.queue, self.titles, self.video_urls))
-            # Shuffle the triplets
-            random.shuffle(queue_triplets)
-            # Unzip the triplets back into separate lists
-            self.queue, self.titles, self.video_urls = map(list, zip(*queue_triplets))
+            self.queue.shuffle()
+
+            # The pre-buffered source belongs to the old next song
+            if self.prebuffer and self.prebuffer[0] is not self.queue.peek():
+                self.discard_prebuffer()
+            self.schedule_prefetch()
             return True
         return False
 
@@ -416,6 +777,7 @@ class MusicPlayer:
         """Pause the current song"""
         if self.guild.voice_client and self.guild.voice_client.is_playing():
             self.guild.voice_client.pause()
+            self.paused_at = time.monotonic()
             return True
         return False
 
@@ -423,6 +785,10 @@ class MusicPlayer:
         """Resume the current song"""
         if self.guild.voice_client and self.guild.voice_client.is_paused():
             self.guild.voice_client.resume()
+            if self.paused_at is not None:
+                self.paused_total += time.monotonic() - self.paused_at
+                self.paused_at = None
+            self._schedule_prebuffer()
             return True
         return False
 
@@ -437,19 +803,108 @@ class MusicPlayer:
 
     def clear_queue(self):
         """Clear the song queue"""
-        self.queue = []
-        self.titles = []
-        self.video_urls = []
+        self.cancel_ingest()
+        self.cancel_prefetch()
+        self.discard_prebuffer()
+        self.queue.clear()
+        self.queue_epoch += 1
+        self.starting = False
         self.current_song = None
         self.current_video_url = None
+        self.current_track = None
+        self.current_entry = None
+
+    async def restore_state(self, autoplay=True):
+        """Queue the songs saved before a restart, resuming the interrupted one at its offset"""
+        if self.state_loaded:
+            return 0
+        self.state_loaded = True
+        if self.state_saver is None:
+            return 0
+
+        playback, rows = await self.resolver.run(self.state_saver.store.load, self.guild.id)
+        self.state_saver.watch(self)
+
+        # Streams are not resolved here, only when each song is about to play
+        tracks = [self._track_from_row(row) for row in rows]
+        if playback:
+            tracks.insert(0, self._track_from_row(playback))
+
+        # Restored songs go ahead of anything queued since the restart
+        for track in reversed(tracks):
+            self.queue.appendleft(track)
+
+        voice_client = self.guild.voice_client
+        if tracks and autoplay and voice_client and not (voice_client.is_playing() or voice_client.is_paused()):
+            await self.play_next()
+        return len(tracks)
+
+    def snapshot_state(self):
+        """Return (guild_id, queue changes or None if unchanged, playback row) when something needs saving"""
+        if not self.state_loaded:
+            return None
+
+        voice_client = self.guild.voice_client
+        playing = voice_client and (voice_client.is_playing() or voice_client.is_paused())
+        track = self.current_track if playing else None
+        queue_changed = self.queue.version != self.saved_queue_version
+        if not queue_changed and track is None and not self.playback_saved:
+            return None
+
+        changes = self._queue_changes() if queue_changed else None
+        playback = self._track_row(track, self.playback_position()) if track else None
+        self.saved_queue_version = self.queue.version
+        self.playback_saved = track is not None
+        return self.guild.id, changes, playback
+
+    def _queue_changes(self):
+        """(replace, removed sequence numbers, added rows) since the last snapshot, everything after a reorder"""
+        queued = {track.seq: track for track in self.queue}
+        if self.queue.layout != self.saved_queue_layout:
+            self.saved_queue_layout = self.queue.layout
+            self.saved_seqs = set(queued)
+            return True, (), [(seq,) + self._track_row(track) for seq, track in queued.items()]
+
+        removed = self.saved_seqs - queued.keys()
+        added = [(seq,) + self._track_row(track) for seq, track in queued.items() if seq not in self.saved_seqs]
+        self.saved_seqs = set(queued)
+        return False, removed, added
+
+    @staticmethod
+    def _track_row(track, start_at=None):
+        """Row for the state store, the playing song is saved with its current position as start offset"""
+        start_at = track.start_at if start_at is None else start_at
+        return track.source, track.title, track.video_id, track.duration, track.requester, start_at
+
+    @staticmethod
+    def _track_from_row(row):
+        source, title, video_id, duration, requester, start_at = row
+        track = Track(source, title, video_id, duration, requester)
+        track.start_at = start_at or 0
+        return track
+
+    def touch(self):
+        """Mark the player as used"""
+        self.last_active = time.monotonic()
+
+    def close(self):
+        """Cancel every background task and release pending sources before the player is dropped"""
+        self.clear_queue()
+        self.watchdog.stop()
+        self.last_interaction = None
+        # Keep whatever was saved for this guild, eviction is not a user clearing the queue
+        if self.state_saver:
+            self.state_saver.unwatch(self)
 
     def get_queue_info(self):
         """Return information about the current queue"""
+        info = [track.title for track in self.queue]
         if self.current_song:
-            return [f"Currently playing: {self.current_song}"] + self.titles
-        return self.titles
-
-    def __del__(self):
-        """Clean up thread pool when the player is deleted"""
-        if hasattr(self, 'thread_pool'):
-            self.thread_pool.shutdown()
\ No newline at end of file
+            info = [f"Currently playing: {self.current_song}"] + info
+
+        # Show playlists that are still loading
+        for progress in self.ingest_tasks.values():
+            total = f"/{progress['total']}" if progress['total'] else ""
+            failed = f", {len(progress['failed'])} unavailable" if progress['failed'] else ""
+            info = info + [f"Loading {progress['label']}: {progress['added']}{total} songs queued so far{failed}..."]
+        return info
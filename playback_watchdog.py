@@ -0,0 +1,105 @@
+import os
+import time
+import asyncio
+import discord
+
+watchdog_interval = float(os.getenv("WATCHDOG_INTERVAL", "2"))
+# Seconds without a single audio frame before FFmpeg is considered stuck
+stall_timeout = float(os.getenv("STALL_TIMEOUT", "10"))
+# Restarts of the same song before giving up on it
+max_recoveries = int(os.getenv("MAX_RECOVERIES", "3"))
+# Seconds a restarted song has to play before its restarts stop counting towards that limit
+recovery_reset = float(os.getenv("RECOVERY_RESET_SECONDS", "30"))
+# A stream that ends further than this before the song's duration died early
+early_end_margin = float(os.getenv("EARLY_END_MARGIN", "5"))
+
+# discord.py reads one 20 ms frame per read(), both for PCM and Opus sources
+FRAME_SECONDS = 0.02
+
+
+class TrackedSource(discord.AudioSource):
+    """Wraps the playing source and counts frames, so the position survives pauses and reconnects exactly"""
+
+    def __init__(self, source, start_at=0):
+        self.source = source
+        self.start_at = start_at  # Where FFmpeg was started (-ss)
+        self.frames = 0
+        self.eof = False
+        self.last_frame_at = time.monotonic()
+
+    def read(self):
+        # Runs on discord.py's audio thread
+        data = self.source.read()
+        if data:
+            self.frames += 1
+            self.last_frame_at = time.monotonic()
+        else:
+            self.eof = True
+        return data
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+
+    @property
+    def position(self):
+        """Seconds into the song"""
+        return self.start_at + self.frames * FRAME_SECONDS
+
+    def stalled_for(self):
+        return time.monotonic() - self.last_frame_at
+
+    def touch(self):
+        """Restart the stall clock, nothing is read while paused or reconnecting"""
+        self.last_frame_at = time.monotonic()
+
+    def ended_early(self, duration, margin=early_end_margin):
+        """True if FFmpeg hit the end of its input well before the end of the song"""
+        return self.eof and bool(duration) and self.position < duration - margin
+
+
+class PlaybackWatchdog:
+    """Restarts a player's current song at its position when FFmpeg stops producing audio"""
+
+    def __init__(self, player, interval=watchdog_interval, stall_timeout=stall_timeout,
+                 max_recoveries=max_recoveries, recovery_reset=recovery_reset):
+        self.player = player
+        self.interval = interval
+        self.stall_timeout = stall_timeout
+        self.max_recoveries = max_recoveries
+        self.recovery_reset = recovery_reset
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            player = self.player
+            voice_client = player.guild.voice_client
+            source = player.tracked_source
+            if voice_client is None or source is None or player.current_track is None:
+                return  # Started again with the next song
+
+            if voice_client.is_paused() or not voice_client.is_playing() or not voice_client.is_connected():
+                # discord.py holds playback while the voice connection reconnects
+                source.touch()
+                continue
+
+            if source.stalled_for() > self.stall_timeout:
+                try:
+                    await player.recover("stall")
+                except Exception as e:
+                    print(f"Error recovering playback: {str(e)}")
+            elif player.recovery_attempts and source.frames * FRAME_SECONDS > self.recovery_reset:
+                # The restarted source is healthy, a later failure starts from a reused stream again
+                player.recovery_attempts = 0
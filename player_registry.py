@@ -0,0 +1,86 @@
+import os
+import time
+import asyncio
+from music_player import MusicPlayer
+
+player_idle_timeout = float(os.getenv("PLAYER_IDLE_TIMEOUT", "900"))
+player_sweep_interval = float(os.getenv("PLAYER_SWEEP_INTERVAL", "60"))
+
+
+class PlayerRegistry:
+    """Creates a MusicPlayer per guild and evicts players that sit idle without a voice connection"""
+
+    def __init__(self, bot, idle_timeout=player_idle_timeout, sweep_interval=player_sweep_interval):
+        self.bot = bot
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self.players = {}
+        self.disconnected_since = {}  # Guild ID -> when a sweep first found its player without voice
+        self.evicted = 0
+        self._sweeper = None
+
+    def get(self, guild):
+        """Get or create the music player for a guild"""
+        player = self.players.get(guild.id)
+        if player is None:
+            player = self.players[guild.id] = MusicPlayer(self.bot, guild)
+        player.touch()
+
+        # The sweeper needs a running event loop, so it starts with the first command
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop())
+        return player
+
+    def is_idle(self, player, now=None):
+        """A player is idle once it has been without a voice connection, and unused, for the timeout"""
+        now = time.monotonic() if now is None else now
+        guild_id = player.guild.id
+        if player.guild.voice_client is not None:
+            self.disconnected_since.pop(guild_id, None)
+            return False
+        # Measured from the disconnect, a song can play for longer than the timeout without any command
+        since = self.disconnected_since.setdefault(guild_id, now)
+        return now - max(player.last_active, since) >= self.idle_timeout
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error evicting idle players: {str(e)}")
+
+    def sweep(self):
+        """Evict every idle player, returning how many were evicted"""
+        now = time.monotonic()
+        idle = [guild_id for guild_id, player in self.players.items() if self.is_idle(player, now)]
+        for guild_id in idle:
+            self.evict(guild_id)
+        return len(idle)
+
+    def evict(self, guild_id):
+        """Close and forget a guild's player"""
+        player = self.players.pop(guild_id, None)
+        self.disconnected_since.pop(guild_id, None)
+        if player is not None:
+            player.close()
+            self.evicted += 1
+
+    def stats(self):
+        """Return live (connected), idle (not connected) and evicted player counts"""
+        live = sum(1 for player in self.players.values() if player.guild.voice_client is not None)
+        return {'live': live, 'idle': len(self.players) - live, 'evicted': self.evicted}
+
+    def close(self):
+        """Stop the sweeper and close every player"""
+        if self._sweeper:
+            self._sweeper.cancel()
+            self._sweeper = None
+        for guild_id in list(self.players):
+            self.evict(guild_id)
+
+    def __contains__(self, guild_id):
+        return guild_id in self.players
+
+    def __len__(self):
+        return len(self.players)
@@ -0,0 +1,90 @@
+import os
+import discord
+
+queue_page_size = int(os.getenv("QUEUE_PAGE_SIZE", "10"))
+queue_view_timeout = float(os.getenv("QUEUE_VIEW_TIMEOUT", "300"))
+
+# Keep long titles from pushing a page past the embed description limit
+MAX_TITLE_LENGTH = 90
+
+
+def format_duration(seconds):
+    """Format seconds as m:ss or h:mm:ss"""
+    seconds = int(seconds or 0)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+class QueueView(discord.ui.View):
+    """Paged queue embed, every render walks the queue up to the end of the visible page only"""
+
+    def __init__(self, player, page_size=queue_page_size, timeout=queue_view_timeout):
+        super().__init__(timeout=timeout)
+        self.player = player
+        self.page_size = page_size
+        self.page = 0
+        self.message = None
+
+    def page_count(self):
+        return max(1, -(-len(self.player.queue) // self.page_size))
+
+    def build_embed(self):
+        """Render the current page, clamping it in case the queue shrank since the last render"""
+        queue = self.player.queue
+        pages = self.page_count()
+        self.page = min(self.page, pages - 1)
+        start = self.page * self.page_size
+
+        lines = []
+        for position, track in enumerate(queue.page(start, self.page_size), start + 1):
+            title = track.title if len(track.title) <= MAX_TITLE_LENGTH else track.title[:MAX_TITLE_LENGTH - 1] + "…"
+            duration = f" `{format_duration(track.duration)}`" if track.duration else ""
+            lines.append(f"{position}. {title}{duration}")
+
+        embed = discord.Embed(title="Current Queue", description="\n".join(lines) or "Queue is empty.")
+        if self.player.current_song:
+            position = format_duration(self.player.playback_position())
+            length = f"/{format_duration(self.player.current_duration)}" if self.player.current_duration else ""
+            embed.add_field(name="Currently playing", value=f"{self.player.current_song} ({position}{length})",
+                            inline=False)
+
+        # Playlists that are still loading
+        for progress in self.player.ingest_tasks.values():
+            total = f"/{progress['total']}" if progress['total'] else ""
+            failed = f", {len(progress['failed'])} unavailable" if progress['failed'] else ""
+            embed.add_field(name=f"Loading {progress['label']}",
+                            value=f"{progress['added']}{total} songs queued so far{failed}...", inline=False)
+
+        embed.set_footer(text=f"Page {self.page + 1}/{pages} · {len(queue)} songs · "
+                              f"{format_duration(queue.total_duration)} total")
+
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= pages - 1
+        return embed
+
+    async def _show(self, interaction, page):
+        self.page = max(0, page)
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+    @discord.ui.button(label="Prev", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page - 1)
+
+    @discord.ui.button(label="Refresh", style=discord.ButtonStyle.secondary)
+    async def refresh(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page + 1)
+
+    async def on_timeout(self):
+        # Leave the last page visible without buttons that no longer respond
+        if self.message:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
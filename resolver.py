@@ -0,0 +1,314 @@
+import dotenv
+import os
+import time
+import asyncio
+import importlib
+import threading
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import extract_worker
+from stream_cache import StreamCache, video_id_from_url
+from match_cache import MatchCache, normalize_query
+from audio_cache import AudioCache, audio_cache_dir
+from scheduler import ExtractionScheduler, INTERACTIVE, BULK
+from url_router import YOUTUBE_VIDEO, SPOTIFY_TRACK, LINK
+from metrics import (timed, STAGE_SECONDS, RESOLVER_WORKERS, RESOLVER_BUSY, RESOLVER_PENDING,
+                     RESOLVER_WAIT_SECONDS, COALESCED)
+
+dotenv.load_dotenv()
+
+client = os.getenv("SPOTIFY_CLIENT")
+secret = os.getenv("SPOTIFY_SECRET")
+resolver_workers = int(os.getenv("RESOLVER_WORKERS", "8"))
+# Run yt_dlp extraction in this many long-lived worker processes instead of resolver threads (0 disables)
+extraction_processes = int(os.getenv("EXTRACTION_PROCESSES", "0"))
+
+# yt_dlp option sets shared by every resolution path
+SEARCH_FLAT_OPTS = {
+    'format': 'bestaudio/best',
+    'noplaylist': True,
+    'quiet': True,
+    'extract_flat': True,
+}
+STREAM_OPTS = {
+    # Prefer Opus audio so it can be passed to Discord without re-encoding
+    'format': 'bestaudio[acodec=opus]/bestaudio/best',
+    'noplaylist': True,
+    'quiet': True,
+}
+PLAYLIST_FLAT_OPTS = {
+    'format': 'bestaudio/best',
+    'quiet': True,
+    'extract_flat': True,
+    'force_generic_extractor': False
+}
+
+
+class Resolver:
+    """Process-wide worker pool and clients used by every MusicPlayer for lookups"""
+
+    def __init__(self, max_workers=resolver_workers, processes=extraction_processes):
+        # One bounded pool caps concurrent yt_dlp / Spotify calls across all guilds
+        self.thread_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="resolver")
+        self.max_workers = max_workers
+        RESOLVER_WORKERS.set(max_workers)
+
+        # Optional extraction processes keep yt_dlp's CPU-heavy parsing and deciphering off the event loop's GIL.
+        # Resolver threads still do the cache lookups and block on the process result.
+        self.processes = processes
+        self.process_pool = self._start_process_pool() if processes else None
+        self._process_pool_lock = threading.Lock()
+
+        # YoutubeDL instances are not thread safe, so each worker keeps its own per option set
+        self._local = threading.local()
+
+        self._sp = None
+        self._sp_lock = threading.Lock()
+
+        # Resolved stream URLs shared by every guild until googlevideo expires them
+        self.stream_cache = StreamCache()
+
+        # Spotify track / search query -> YouTube video matches that survive restarts
+        self.match_cache = MatchCache()
+
+        # Optional on-disk copies of frequently played tracks
+        self.audio_cache = AudioCache(audio_cache_dir) if audio_cache_dir else None
+
+        # Adapts how many extractions run at once and puts interactive requests ahead of bulk work
+        self.scheduler = ExtractionScheduler(self.run, max_workers)
+
+        # Identical requests currently queued or running, keyed by (kind, canonical id)
+        self._inflight = {}
+        self.coalesced = {}
+
+    def _start_process_pool(self):
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"),
+            initializer=extract_worker.warm_up, initargs=(STREAM_OPTS,))
+
+    def _run_in_process(self, func, *args):
+        """Run an extraction in a worker process, starting a new pool once if a worker died (blocking)"""
+        pool = self.process_pool
+        try:
+            return pool.submit(func, *args).result()
+        except BrokenProcessPool:
+            # A crashed or killed worker breaks the whole pool for good
+            with self._process_pool_lock:
+                if self.process_pool is pool:
+                    print("An extraction process died, starting a new process pool")
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self.process_pool = self._start_process_pool()
+                pool = self.process_pool
+            return pool.submit(func, *args).result()
+
+    @property
+    def sp(self):
+        """Shared Spotify client, the auth manager caches and refreshes its token"""
+        if self._sp is None:
+            with self._sp_lock:
+                if self._sp is None:
+                    # spotipy is only imported once something actually needs Spotify
+                    from spotipy import Spotify
+                    from spotipy.oauth2 import SpotifyClientCredentials
+                    self._sp = Spotify(auth_manager=SpotifyClientCredentials(
+                        client_id=client,
+                        client_secret=secret))
+        return self._sp
+
+    def get_ydl(self, ydl_opts):
+        """Return this worker thread's YoutubeDL instance for the given options"""
+        key = tuple(sorted(ydl_opts.items()))
+        instances = getattr(self._local, 'ydl_instances', None)
+        if instances is None:
+            instances = self._local.ydl_instances = {}
+
+        ydl = instances.get(key)
+        if ydl is None:
+            import yt_dlp  # Deferred so startup does not pay for loading every extractor
+            ydl = instances[key] = yt_dlp.YoutubeDL(dict(ydl_opts))
+        return ydl
+
+    def warm_up(self):
+        """Import yt_dlp on the pool in the background, so neither startup nor the first /play waits for it"""
+        if self.process_pool:
+            # Starting the processes runs their initializer, which builds warm YoutubeDL instances
+            for _ in range(self.processes):
+                self.process_pool.submit(int)
+        else:
+            self.thread_pool.submit(importlib.import_module, "yt_dlp")
+
+    def extract_stream(self, url):
+        """Resolve a YouTube video URL to its stream, checking the stream cache first (blocking)"""
+        video_id = video_id_from_url(url)
+        if video_id and self.audio_cache:
+            local = self.audio_cache.lookup(video_id)
+            if local:
+                return local
+        if video_id:
+            cached = self.stream_cache.get(video_id)
+            if cached:
+                return cached
+
+        with timed(STAGE_SECONDS, stage="extract"):
+            info = self.extract(url, STREAM_OPTS)
+        return self._remember_stream(info, url)
+
+    def search_stream(self, query):
+        """Resolve the top YouTube search result for a query to its stream (blocking)"""
+        key = self.match_cache.query_key(query)
+        match = self.match_cache.get(key)
+        if match:
+            return self.extract_stream(f"https://www.youtube.com/watch?v={match[0]}")
+
+        with timed(STAGE_SECONDS, stage="search"):
+            info = self.extract(f"ytsearch:{query}", STREAM_OPTS)
+        entry = self._remember_stream(info)
+        self.match_cache.put(key, entry['video_id'], entry['title'])
+        return entry
+
+    def resolve_spotify_track(self, track_id):
+        """Resolve a Spotify track to the stream of its YouTube match (blocking)"""
+        key = self.match_cache.spotify_key(track_id)
+        match = self.match_cache.get(key)
+        if match:
+            return self.extract_stream(f"https://www.youtube.com/watch?v={match[0]}")
+
+        with timed(STAGE_SECONDS, stage="spotify_track"):
+            track_info = self.sp.track(track_id)
+        query = f"{track_info['name']} {track_info['artists'][0]['name']}"
+        # Convert to a YouTube search
+        entry = self.search_stream(query)
+        self.match_cache.put(key, entry['video_id'], entry['title'])
+        return entry
+
+    def extract(self, url, ydl_opts):
+        """Extract the compact stream info of a video, or the first result of a search or playlist (blocking)"""
+        if self.process_pool:
+            return self._run_in_process(extract_worker.extract_stream, url, ydl_opts)
+        return extract_worker.compact_stream(self.get_ydl(ydl_opts).extract_info(url, download=False))
+
+    def extract_flat(self, url, ydl_opts):
+        """List the entries of a playlist or search as compact {id, title, duration} dicts (blocking)"""
+        if self.process_pool:
+            return self._run_in_process(extract_worker.extract_flat, url, ydl_opts)
+        return extract_worker.compact_flat(self.get_ydl(ydl_opts).extract_info(url, download=False))
+
+    def _remember_stream(self, info, url=None):
+        """Store a compact extraction result in the stream cache and return the cached entry"""
+        entry = {
+            'video_id': info.get('id'),
+            'stream_url': info['url'],  # This is the actual playable stream URL
+            'title': info['title'],
+            'video_url': info.get('webpage_url') or url,  # Original video URL
+            'duration': info.get('duration'),
+            'acodec': info.get('acodec'),
+        }
+        if info.get('id'):
+            self.stream_cache.put(info['id'], entry)
+        return entry
+
+    def record_play(self, entry):
+        """Count a play and download the track into the audio cache once it is played often enough"""
+        video_id = entry.get('video_id')
+        if self.audio_cache and video_id and not entry.get('local') and self.audio_cache.record_play(video_id):
+            # Rate limits still back the scheduler off, but a download's run time does not shrink its limit
+            job = self.scheduler.submit(partial(self._download_audio, video_id), BULK, measured=False)
+            job.future.add_done_callback(partial(self._download_done, video_id))
+
+    def _download_audio(self, video_id):
+        self.audio_cache.download(self.get_ydl(self.audio_cache.download_opts), video_id)
+
+    @staticmethod
+    def _download_done(video_id, future):
+        if not future.cancelled() and future.exception():
+            print(f"Error caching audio for {video_id}: {str(future.exception())}")
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking call on the shared pool without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.thread_pool, self._instrumented(partial(func, *args, **kwargs)))
+
+    async def coalesce(self, key, func, *args, priority=INTERACTIVE, guild=None, **kwargs):
+        """Schedule a blocking call for a guild unless an identical one is already in flight, then share its result"""
+        job = self._inflight.get(key)
+        if job is not None:
+            self.coalesced[key[0]] = self.coalesced.get(key[0], 0) + 1
+            COALESCED.inc(kind=key[0])
+            # An interactive request waiting on queued bulk work moves it ahead
+            self.scheduler.promote(job, priority)
+        else:
+            job = self.scheduler.submit(partial(func, *args, **kwargs), priority, guild)
+            self._inflight[key] = job
+            job.future.add_done_callback(partial(self._finish_inflight, key))
+        future = job.future
+
+        # A waiter being cancelled (e.g. a dropped prefetch) must not cancel the work for the others
+        return await asyncio.shield(future)
+
+    def _finish_inflight(self, key, future):
+        self._inflight.pop(key, None)
+        if not future.cancelled():
+            # Mark the exception as retrieved in case every waiter was cancelled
+            future.exception()
+
+    @staticmethod
+    def resolution_key(ref):
+        """Canonical key for a parsed reference, so the same song requested differently is resolved once"""
+        if ref.kind == SPOTIFY_TRACK:
+            return 'spotify_track', ref.id
+        elif ref.kind == YOUTUBE_VIDEO:
+            return 'video', ref.id
+        elif ref.kind == LINK:
+            return 'link', ref.query
+        return 'query', normalize_query(ref.query)
+
+    def cached_stream(self, video_id):
+        """Stream entry from the in-memory cache, None if the audio cache might have a local copy instead"""
+        if self.audio_cache and video_id in self.audio_cache.index:
+            return None
+        return self.stream_cache.get(video_id)
+
+    @staticmethod
+    def _instrumented(call):
+        """Wrap a pool job so queue wait and worker saturation show up in the metrics"""
+        submitted = time.perf_counter()
+        RESOLVER_PENDING.inc()
+
+        def _run():
+            RESOLVER_WAIT_SECONDS.observe(time.perf_counter() - submitted)
+            RESOLVER_BUSY.inc()
+            try:
+                return call()
+            finally:
+                RESOLVER_BUSY.dec()
+                RESOLVER_PENDING.dec()
+
+        return _run
+
+    def cache_stats(self):
+        """Counters of every enabled cache, keyed by cache name"""
+        stats = {'stream': self.stream_cache.stats(), 'match': self.match_cache.stats()}
+        if self.audio_cache:
+            stats['audio'] = self.audio_cache.stats()
+        return stats
+
+    def shutdown(self):
+        """Stop the worker pool and close the match cache"""
+        self.thread_pool.shutdown(wait=False, cancel_futures=True)
+        if self.process_pool:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
+        self.match_cache.close()
+
+
+_resolver = None
+
+
+def get_resolver():
+    """Return the process-wide resolver, creating it on first use"""
+    global _resolver
+    if _resolver is None:
+        _resolver = Resolver()
+    return _resolver
@@ -0,0 +1,306 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+from collections import deque
+from metrics import (EXTRACTION_LIMIT, EXTRACTION_IN_FLIGHT, EXTRACTION_RETRIES, RATE_LIMITED,
+                     SCHEDULER_WAIT_SECONDS, GUILD_WAIT_SECONDS)
+
+extraction_min_concurrency = int(os.getenv("EXTRACTION_MIN_CONCURRENCY", "1"))
+extraction_initial_concurrency = int(os.getenv("EXTRACTION_INITIAL_CONCURRENCY", "4"))
+# Jobs slower than this are taken as a sign that YouTube or the host is overloaded
+extraction_target_latency = float(os.getenv("EXTRACTION_TARGET_LATENCY", "5"))
+extraction_max_retries = int(os.getenv("EXTRACTION_MAX_RETRIES", "3"))
+backoff_base = float(os.getenv("EXTRACTION_BACKOFF_BASE", "2"))
+backoff_max = float(os.getenv("EXTRACTION_BACKOFF_MAX", "120"))
+# Jobs one guild may have running at once, so a huge playlist cannot take over the pool
+guild_max_in_flight = int(os.getenv("GUILD_MAX_IN_FLIGHT", "2"))
+
+
+def parse_guild_weights(value):
+    """Parse "guild_id:weight,..." into a dict, guilds not listed get a weight of 1"""
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        guild, _, weight = item.partition(":")
+        weights[int(guild)] = float(weight)
+    return weights
+
+
+guild_weights = parse_guild_weights(os.getenv("GUILD_WEIGHTS", ""))
+
+# Priorities, lower runs first
+INTERACTIVE = 0
+BULK = 1
+
+RATE_LIMIT_MARKERS = ("429", "too many requests", "rate limit", "rate-limit", "confirm you're not a bot")
+# Errors that will not go away by retrying
+PERMANENT_MARKERS = ("video unavailable", "private video", "has been removed", "not available in your country",
+                     "members-only", "copyright", "sign in to confirm your age", "unsupported url")
+# Network trouble in the message of a yt_dlp or spotipy error, worth another attempt
+TRANSIENT_MARKERS = ("timed out", "timeout", "connection", "temporarily", "temporary failure", "network",
+                     "incomplete read", "http error 5", "unable to download webpage")
+
+
+def is_rate_limited(error):
+    message = str(error).lower()
+    return getattr(error, 'http_status', None) == 429 or any(marker in message for marker in RATE_LIMIT_MARKERS)
+
+
+def is_permanent(error):
+    message = str(error).lower()
+    return any(marker in message for marker in PERMANENT_MARKERS)
+
+
+def is_transient(error):
+    """True for network failures and server errors, everything else (no search results, bad input) fails at once"""
+    if is_permanent(error):
+        return False
+    # yt_dlp's DownloadError carries the exception it wrapped
+    cause = (getattr(error, 'exc_info', None) or (None, None))[1]
+    if isinstance(error, (OSError, asyncio.TimeoutError)) or isinstance(cause, (OSError, asyncio.TimeoutError)):
+        return True
+    status = getattr(error, 'http_status', None)
+    if status is not None:
+        return status >= 500
+    if getattr(error, 'expected', False):
+        return False  # An ExtractorError yt_dlp reports as the video's own problem
+    message = str(error).lower()
+    return any(marker in message for marker in TRANSIENT_MARKERS)
+
+
+class Job:
+    __slots__ = ('call', 'priority', 'guild', 'future', 'attempts', 'queued_at', 'started', 'tag', 'measured')
+
+    def __init__(self, call, priority, guild, future, measured=True):
+        self.call = call
+        self.priority = priority
+        self.guild = guild  # Guild ID the work is charged to, None for shared work
+        self.future = future
+        self.measured = measured  # False for long jobs like downloads, whose run time says nothing about load
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+        self.started = False
+        self.tag = 0.0  # Virtual finish time used for fair queuing between guilds
+
+
+class GuildState:
+    """Per-guild queues and accounting for fair queuing"""
+
+    __slots__ = ('weight', 'last_tag', 'in_flight', 'queues')
+
+    def __init__(self, weight):
+        self.weight = weight
+        self.last_tag = 0.0
+        self.in_flight = 0
+        self.queues = {INTERACTIVE: deque(), BULK: deque()}
+
+    def idle(self):
+        return not self.in_flight and not any(self.queues.values())
+
+
+class ExtractionScheduler:
+    """AIMD concurrency limit with priorities, per-guild fair queuing, jittered backoff and retries"""
+
+    def __init__(self, run, max_concurrency, min_concurrency=extraction_min_concurrency,
+                 initial_concurrency=extraction_initial_concurrency, target_latency=extraction_target_latency,
+                 max_retries=extraction_max_retries, guild_max_in_flight=guild_max_in_flight,
+                 guild_weights=guild_weights):
+        self.run = run  # Coroutine function that executes a blocking call off the event loop
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.limit = float(max(self.min_concurrency, min(initial_concurrency, max_concurrency)))
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.guild_max_in_flight = guild_max_in_flight
+        self.guild_weights = dict(guild_weights)
+
+        self.in_flight = 0
+        self.guilds = {}  # Guild ID -> GuildState, dropped again once a guild has nothing queued or running
+        self.virtual_time = 0.0
+        # (priority, tag, order, guild) for the head of each guild's queues, stale entries are skipped
+        self._ready = []
+        self._order = itertools.count()
+        self.backoff_until = 0.0
+        self.consecutive_rate_limits = 0
+        self._wakeup = None
+        EXTRACTION_LIMIT.set(self.limit)
+
+    def submit(self, call, priority=INTERACTIVE, guild=None, measured=True):
+        """Queue a blocking call and return its job, whose future holds the result"""
+        job = Job(call, priority, guild, asyncio.get_running_loop().create_future(), measured)
+        self._enqueue(job)
+        self._dispatch()
+        return job
+
+    def promote(self, job, priority):
+        """Move a job that has not started yet ahead, e.g. when an interactive request joins bulk work"""
+        if job.started or priority >= job.priority:
+            return
+        state = self.guilds.get(job.guild)
+        try:
+            state.queues[job.priority].remove(job)
+        except (AttributeError, ValueError):
+            # Waiting for a retry delay, it is queued with the new priority when it comes back
+            job.priority = priority
+            return
+        job.priority = priority
+        state.queues[priority].append(job)
+        self._push_heads(job.guild, state)
+        self._dispatch()
+
+    def _state(self, guild):
+        state = self.guilds.get(guild)
+        if state is None:
+            state = self.guilds[guild] = GuildState(self.guild_weights.get(guild, 1.0))
+        return state
+
+    def _enqueue(self, job):
+        state = self._state(job.guild)
+        # A guild that went idle restarts at the current virtual time instead of banking credit
+        state.last_tag = max(self.virtual_time, state.last_tag) + 1 / state.weight
+        job.tag = state.last_tag
+        queue = state.queues[job.priority]
+        queue.append(job)
+        if len(queue) == 1:
+            self._push_heads(job.guild, state)
+
+    def _push_heads(self, guild, state):
+        if state.in_flight >= self.guild_max_in_flight:
+            return  # Pushed again when one of its jobs finishes
+        for priority, queue in state.queues.items():
+            if queue:
+                heapq.heappush(self._ready, (priority, queue[0].tag, next(self._order), guild))
+
+    def _pop(self):
+        """Take the next job: interactive first, then the guild with the lowest virtual finish time"""
+        while self._ready:
+            priority, tag, _, guild = heapq.heappop(self._ready)
+            state = self.guilds.get(guild)
+            if state is None or state.in_flight >= self.guild_max_in_flight:
+                continue
+            queue = state.queues[priority]
+            if not queue or queue[0].tag != tag:
+                continue  # Stale entry, the head already ran or moved
+            job = queue.popleft()
+            if queue:
+                heapq.heappush(self._ready, (priority, queue[0].tag, next(self._order), guild))
+            if job.future.done():
+                self._release(job.guild, state)
+                continue
+            self.virtual_time = max(self.virtual_time, job.tag)
+            return job, state
+        return None, None
+
+    def _release(self, guild, state):
+        if state.idle():
+            del self.guilds[guild]
+
+    def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        wait = self.backoff_until - time.monotonic()
+        if wait > 0:
+            # Rate limited, come back once the backoff has passed
+            if self._wakeup is None:
+                self._wakeup = loop.call_later(wait, self._wake)
+            return
+
+        while self.in_flight < int(self.limit):
+            job, state = self._pop()
+            if job is None:
+                break
+            job.started = True
+            state.in_flight += 1
+            self.in_flight += 1
+            EXTRACTION_IN_FLIGHT.set(self.in_flight)
+            waited = time.monotonic() - job.queued_at
+            SCHEDULER_WAIT_SECONDS.observe(waited, priority="interactive" if job.priority == INTERACTIVE else "bulk")
+            GUILD_WAIT_SECONDS.observe(waited, guild=job.guild if job.guild is not None else "shared")
+            loop.create_task(self._execute(job))
+
+    def _wake(self):
+        self._wakeup = None
+        self._dispatch()
+
+    async def _execute(self, job):
+        started = time.monotonic()
+        try:
+            result = await self.run(job.call)
+        except Exception as e:
+            self._on_failure(job, e)
+        else:
+            if job.measured:
+                self._on_success(time.monotonic() - started)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.in_flight -= 1
+            EXTRACTION_IN_FLIGHT.set(self.in_flight)
+            state = self.guilds[job.guild]
+            state.in_flight -= 1
+            if state.idle():
+                del self.guilds[job.guild]
+            elif state.in_flight == self.guild_max_in_flight - 1:
+                # The guild was at its cap, its queued work is eligible again
+                self._push_heads(job.guild, state)
+            self._dispatch()
+
+    def _on_success(self, latency):
+        self.consecutive_rate_limits = 0
+        if latency > self.target_latency * 2:
+            # Multiplicative decrease when jobs get much slower than the target
+            self._set_limit(self.limit * 0.75)
+        elif latency <= self.target_latency:
+            # Additive increase: roughly one more slot per window of successful jobs
+            self._set_limit(self.limit + 1 / self.limit)
+
+    def _on_failure(self, job, error):
+        job.attempts += 1
+        retry_delay = None
+
+        if is_rate_limited(error):
+            RATE_LIMITED.inc()
+            self.consecutive_rate_limits += 1
+            self._set_limit(self.limit / 2)
+            # Full jitter keeps guilds from retrying in lockstep
+            backoff = random.uniform(0, min(backoff_max, backoff_base * 2 ** self.consecutive_rate_limits))
+            self.backoff_until = max(self.backoff_until, time.monotonic() + backoff)
+            retry_delay = 0
+        elif is_transient(error):
+            retry_delay = random.uniform(0, backoff_base * 2 ** job.attempts)
+
+        if retry_delay is None or job.attempts > self.max_retries:
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+
+        EXTRACTION_RETRIES.inc()
+        job.started = False
+        asyncio.get_running_loop().call_later(retry_delay, self._requeue, job)
+
+    def _requeue(self, job):
+        if not job.future.done():
+            job.queued_at = time.monotonic()
+            self._enqueue(job)
+            self._dispatch()
+
+    def _set_limit(self, limit):
+        self.limit = max(float(self.min_concurrency), min(float(self.max_concurrency), limit))
+        EXTRACTION_LIMIT.set(self.limit)
+
+    def guild_stats(self, guild):
+        """Queued and running jobs for one guild"""
+        state = self.guilds.get(guild)
+        if state is None:
+            return {'queued': 0, 'in_flight': 0}
+        return {'queued': sum(len(queue) for queue in state.queues.values()), 'in_flight': state.in_flight}
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'queued': sum(len(queue) for state in self.guilds.values() for queue in state.queues.values()),
+            'guilds': len(self.guilds),
+            'backoff_remaining': max(0.0, self.backoff_until - time.monotonic()),
+        }
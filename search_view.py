@@ -0,0 +1,71 @@
+import os
+import discord
+
+search_view_timeout = float(os.getenv("SEARCH_VIEW_TIMEOUT", "30"))
+
+
+class SearchSelect(discord.ui.Select):
+    """Dropdown of search results, picking one plays it"""
+
+    def __init__(self, results):
+        options = [discord.SelectOption(label=result['title'][:100], value=str(index),
+                                        description=f"Result {index + 1}")
+                   for index, result in enumerate(results)]
+        super().__init__(placeholder="Choose a song to play", options=options)
+
+    async def callback(self, interaction: discord.Interaction):
+        await self.view.choose(interaction, int(self.values[0]))
+
+
+class SearchView(discord.ui.View):
+    """/search results as a select menu, only the user who searched can choose"""
+
+    def __init__(self, player, user, results, timeout=search_view_timeout):
+        super().__init__(timeout=timeout)
+        self.player = player
+        self.user = user
+        self.results = results
+        self.message = None
+        self.add_item(SearchSelect(results))
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user.id != self.user.id:
+            await interaction.response.send_message("Only the person who searched can choose a result.",
+                                                    ephemeral=True)
+            return False
+        return True
+
+    async def choose(self, interaction, index):
+        selected = self.results[index]
+        self.stop()
+
+        # Replace the menu with the choice so it cannot be picked twice
+        await interaction.response.edit_message(content=f"Processing your selection: {selected['title']}...",
+                                                view=None)
+
+        # Check if user is in a voice channel
+        if not interaction.user.voice:
+            await interaction.followup.send("You need to be in a voice channel to play music.")
+            return
+
+        # Connect to voice channel if not already connected
+        if not interaction.guild.voice_client:
+            try:
+                await interaction.user.voice.channel.connect()
+            except Exception as e:
+                await interaction.followup.send(f"Error connecting to voice channel: {str(e)}")
+                return
+
+        try:
+            await self.player.restore_state(autoplay=False)
+            # The result was resolved in the background while the user was choosing, so this is a cache hit
+            await self.player.play(interaction, selected['url'])
+        except Exception as e:
+            await interaction.followup.send(f"Error processing selection: {str(e)}")
+
+    async def on_timeout(self):
+        if self.message:
+            try:
+                await self.message.edit(content="Selection timed out.", view=None)
+            except discord.HTTPException:
+                pass
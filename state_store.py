@@ -0,0 +1,125 @@
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+
+state_path = os.getenv("STATE_PATH", "player_state.sqlite3")  # Persistence disabled when empty
+state_flush_interval = float(os.getenv("STATE_FLUSH_INTERVAL", "10"))
+
+
+class StateStore:
+    """SQLite snapshots of every guild's queue, current song and playback offset"""
+
+    def __init__(self, path=state_path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS queue ("
+                "guild_id INTEGER NOT NULL, position INTEGER NOT NULL, source TEXT NOT NULL, title TEXT, "
+                "video_id TEXT, duration REAL, requester TEXT, start_at REAL NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (guild_id, position))")
+            # Files written before queued songs kept their start offset
+            columns = [column[1] for column in self._conn.execute("PRAGMA table_info(queue)")]
+            if 'start_at' not in columns:
+                self._conn.execute("ALTER TABLE queue ADD COLUMN start_at REAL NOT NULL DEFAULT 0")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS playback ("
+                "guild_id INTEGER PRIMARY KEY, source TEXT NOT NULL, title TEXT, video_id TEXT, duration REAL, "
+                "requester TEXT, offset REAL NOT NULL, updated_at REAL NOT NULL)")
+
+    def save(self, snapshots):
+        """Write (guild_id, queue changes or None if unchanged, playback_row or None) snapshots in one transaction.
+
+        Queue changes are (replace, removed positions, added rows): only the rows that changed are written, unless
+        replace is set after a reorder. Positions are the queue's sequence numbers, they sort but have gaps.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            for guild_id, queue, playback in snapshots:
+                if queue is not None:
+                    replace, removed, added = queue
+                    if replace:
+                        self._conn.execute("DELETE FROM queue WHERE guild_id = ?", (guild_id,))
+                    elif removed:
+                        self._conn.executemany("DELETE FROM queue WHERE guild_id = ? AND position = ?",
+                                               ((guild_id, position) for position in removed))
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO queue (guild_id, position, source, title, video_id, duration, "
+                        "requester, start_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        ((guild_id,) + tuple(row) for row in added))
+
+                if playback is None:
+                    self._conn.execute("DELETE FROM playback WHERE guild_id = ?", (guild_id,))
+                else:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO playback "
+                        "(guild_id, source, title, video_id, duration, requester, offset, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (guild_id,) + tuple(playback) + (now,))
+
+    def load(self, guild_id):
+        """Return (playback_row or None, queue_rows) for a guild"""
+        with self._lock:
+            playback = self._conn.execute(
+                "SELECT source, title, video_id, duration, requester, offset FROM playback WHERE guild_id = ?",
+                (guild_id,)).fetchone()
+            rows = self._conn.execute(
+                "SELECT source, title, video_id, duration, requester, start_at FROM queue WHERE guild_id = ? "
+                "ORDER BY position", (guild_id,)).fetchall()
+        return playback, rows
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class StateSaver:
+    """Periodically persists the players whose queue changed or that are playing"""
+
+    def __init__(self, store, resolver, interval=state_flush_interval):
+        self.store = store
+        self.resolver = resolver
+        self.interval = interval
+        self.players = set()
+        self._task = None
+
+    def watch(self, player):
+        self.players.add(player)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    def unwatch(self, player):
+        """Stop saving a player without touching what was saved for it"""
+        self.players.discard(player)
+
+    async def _flush_loop(self):
+        while self.players:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error saving player state: {str(e)}")
+
+    async def flush(self):
+        """Snapshot changed players on the event loop, then write them on the resolver pool"""
+        snapshots = []
+        for player in list(self.players):
+            snapshot = player.snapshot_state()
+            if snapshot is not None:
+                snapshots.append(snapshot)
+        if snapshots:
+            await self.resolver.run(self.store.save, snapshots)
+
+
+_state_saver = None
+
+
+def get_state_saver(resolver):
+    """Return the process-wide state saver, or None when persistence is disabled"""
+    global _state_saver
+    if _state_saver is None and state_path:
+        _state_saver = StateSaver(StateStore(state_path), resolver)
+    return _state_saver
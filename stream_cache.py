@@ -0,0 +1,98 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+stream_cache_size = int(os.getenv("STREAM_CACHE_SIZE", "1024"))
+# Stop handing out a URL this many seconds before googlevideo expires it, so a track can finish streaming
+stream_expiry_margin = int(os.getenv("STREAM_EXPIRY_MARGIN", "900"))
+# Lifetime for stream URLs that carry no expire parameter
+stream_default_ttl = int(os.getenv("STREAM_DEFAULT_TTL", "3600"))
+
+VIDEO_ID_PATTERN = re.compile(r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})")
+EXPIRE_PATH_PATTERN = re.compile(r"/expire/(\d+)")
+
+
+def video_id_from_url(url):
+    """Return the YouTube video ID in a URL, or None"""
+    match = VIDEO_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+def stream_expiry(stream_url, default_ttl=stream_default_ttl):
+    """Return the unix time a googlevideo stream URL stops working"""
+    expire = parse_qs(urlparse(stream_url).query).get('expire')
+    if expire and expire[0].isdigit():
+        return int(expire[0])
+
+    # HLS/DASH manifest URLs carry the expiry as a path segment instead
+    match = EXPIRE_PATH_PATTERN.search(stream_url)
+    if match:
+        return int(match.group(1))
+
+    return time.time() + default_ttl
+
+
+class StreamCache:
+    """Thread-safe LRU cache of resolved stream URLs and metadata keyed by video ID"""
+
+    def __init__(self, max_entries=stream_cache_size, expiry_margin=stream_expiry_margin):
+        self.max_entries = max_entries
+        self.expiry_margin = expiry_margin
+        self._entries = OrderedDict()  # video ID -> (expires_at, entry)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, video_id):
+        """Return the cached entry for a video, or None if it is missing or about to expire"""
+        with self._lock:
+            cached = self._entries.get(video_id)
+            if cached is None:
+                self.misses += 1
+                return None
+
+            expires_at, entry = cached
+            if expires_at - self.expiry_margin <= time.time():
+                del self._entries[video_id]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(video_id)
+            self.hits += 1
+            return entry
+
+    def put(self, video_id, entry):
+        """Cache a resolved entry, it must contain the 'stream_url'"""
+        expires_at = stream_expiry(entry['stream_url'])
+        with self._lock:
+            self._entries[video_id] = (expires_at, entry)
+            self._entries.move_to_end(video_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, video_id):
+        """Forget a video, e.g. after its stream URL failed to play"""
+        with self._lock:
+            self._entries.pop(video_id, None)
+
+    def stats(self):
+        """Return hit/miss counters and the current size"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,149 @@
+import random
+from collections import deque
+from itertools import islice
+
+
+class Track:
+    """A queued song, its stream URL is resolved just before it plays"""
+
+    __slots__ = ('source', 'title', 'video_id', 'duration', 'requester', 'state', 'start_at', 'seq')
+
+    # Resolution states
+    PENDING = 'pending'
+    RESOLVED = 'resolved'
+    FAILED = 'failed'
+
+    def __init__(self, source, title, video_id=None, duration=None, requester=None):
+        self.source = source  # Video URL, Spotify track link or search query
+        self.title = title
+        self.video_id = video_id
+        self.duration = duration  # Seconds, None if unknown
+        self.requester = requester
+        self.state = Track.PENDING
+        self.start_at = 0  # Seconds into the song to start from, set when resuming after a restart
+        self.seq = 0  # Set by the queue, orders the saved queue rows
+
+    @property
+    def key(self):
+        """Identity used for de-duplication"""
+        return self.video_id or self.source
+
+    def __repr__(self):
+        return f"Track({self.title!r}, {self.source!r}, state={self.state!r})"
+
+
+class TrackQueue:
+    """Deque of Track records with O(1) append/pop and linear-time bulk operations"""
+
+    def __init__(self, tracks=()):
+        self._tracks = deque()
+        self.total_duration = 0  # Seconds of all queued tracks with a known duration
+        self.version = 0  # Bumped on every change so snapshots can skip unchanged queues
+        self.layout = 0  # Bumped when tracks are reordered or cleared, the next snapshot rewrites the whole queue
+        # Sequence numbers only grow outwards at both ends, so the queue is always sorted by them
+        self._head = 0
+        self._tail = 0
+        self.extend(tracks)
+
+    def append(self, track):
+        track.seq = self._tail
+        self._tail += 1
+        self._tracks.append(track)
+        self.total_duration += track.duration or 0
+        self.version += 1
+
+    def extend(self, tracks):
+        for track in tracks:
+            self.append(track)
+
+    def appendleft(self, track):
+        self._head -= 1
+        track.seq = self._head
+        self._tracks.appendleft(track)
+        self.total_duration += track.duration or 0
+        self.version += 1
+
+    def popleft(self):
+        track = self._tracks.popleft()
+        self.total_duration -= track.duration or 0
+        self.version += 1
+        return track
+
+    def peek(self):
+        """Return the next track without removing it, or None"""
+        return self._tracks[0] if self._tracks else None
+
+    def head(self, count):
+        """Return the next `count` tracks"""
+        return list(islice(self._tracks, count))
+
+    def page(self, start, count):
+        """Return `count` tracks starting at position `start`, O(start + count) as a deque has to be walked"""
+        return list(islice(self._tracks, start, start + count))
+
+    def remove_at(self, index):
+        """Remove and return the track at a position"""
+        track = self._tracks[index]
+        del self._tracks[index]
+        self.total_duration -= track.duration or 0
+        self.version += 1
+        return track
+
+    def remove(self, track):
+        """Remove a track by identity, returning False if it is no longer queued"""
+        for index, queued in enumerate(self._tracks):
+            if queued is track:
+                return self.remove_at(index) is track
+        return False
+
+    def move(self, src, dst):
+        """Move the track at position `src` to position `dst`"""
+        track = self._tracks[src]
+        del self._tracks[src]
+        self._tracks.insert(dst, track)
+        self._renumber()
+
+    def dedupe(self):
+        """Drop later copies of tracks already queued, returning how many were removed"""
+        seen = set()
+        kept = deque()
+        for track in self._tracks:
+            if track.key not in seen:
+                seen.add(track.key)
+                kept.append(track)
+        removed = len(self._tracks) - len(kept)
+        self._tracks = kept
+        self.total_duration = sum(track.duration or 0 for track in kept)
+        self.version += 1
+        return removed
+
+    def shuffle(self):
+        """Shuffle in place, random.shuffle on a list avoids deque's slower indexed access"""
+        tracks = list(self._tracks)
+        random.shuffle(tracks)
+        self._tracks = deque(tracks)
+        self._renumber()
+
+    def clear(self):
+        self._tracks.clear()
+        self.total_duration = 0
+        self._renumber()
+
+    def _renumber(self):
+        for seq, track in enumerate(self._tracks):
+            track.seq = seq
+        self._head, self._tail = 0, len(self._tracks)
+        self.version += 1
+        self.layout += 1
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def __bool__(self):
+        return bool(self._tracks)
+
+    def __iter__(self):
+        return iter(self._tracks)
+
+    def __getitem__(self, index):
+        return self._tracks[index]
@@ -0,0 +1,120 @@
+import re
+from urllib.parse import urlsplit, parse_qs
+
+# Reference kinds
+YOUTUBE_VIDEO = 'youtube_video'
+YOUTUBE_PLAYLIST = 'youtube_playlist'
+SPOTIFY_TRACK = 'spotify_track'
+SPOTIFY_ALBUM = 'spotify_album'
+SPOTIFY_PLAYLIST = 'spotify_playlist'
+QUERY = 'query'
+LINK = 'link'  # Other YouTube pages, handed to yt_dlp as they are
+UNSUPPORTED = 'unsupported'  # Spotify links that are not a track, album or playlist, and Spotify short links
+
+PLAYLIST_KINDS = (YOUTUBE_PLAYLIST, SPOTIFY_ALBUM, SPOTIFY_PLAYLIST)
+
+UNSUPPORTED_MESSAGE = ("Only Spotify track, album and playlist links are supported. For a spotify.link short link, "
+                       "open it and use the open.spotify.com link instead.")
+
+# Cheap first pass, anything that is not a link to a supported host is a search query
+LINK_PATTERN = re.compile(
+    r"^(?:https?://)?(?:[a-z0-9-]+\.)*"
+    r"(?:youtube\.com|youtube-nocookie\.com|youtu\.be|spotify\.com|spotify\.link|spoti\.fi)(?:[/?#:]|$)",
+    re.IGNORECASE)
+SPOTIFY_URI_PATTERN = re.compile(r"^spotify:(track|album|playlist):([A-Za-z0-9]{22})$")
+# open.spotify.com/track/ID, /intl-de/album/ID, /embed/playlist/ID ...
+SPOTIFY_PATH_PATTERN = re.compile(r"^/(?:intl-[A-Za-z-]+/)?(?:embed/)?(track|album|playlist)/([A-Za-z0-9]{22})")
+VIDEO_ID = re.compile(r"^[A-Za-z0-9_-]{11}$")
+PLAYLIST_ID = re.compile(r"^[A-Za-z0-9_-]{2,64}$")
+# /shorts/ID, /embed/ID, /live/ID, /v/ID
+VIDEO_PATH_PATTERN = re.compile(r"^/(?:shorts|embed|live|v)/([A-Za-z0-9_-]{11})")
+# t=90, t=90s, t=1m30s, t=1h2m3s
+TIMESTAMP_PATTERN = re.compile(r"^(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s?)?$")
+
+SPOTIFY_KINDS = {'track': SPOTIFY_TRACK, 'album': SPOTIFY_ALBUM, 'playlist': SPOTIFY_PLAYLIST}
+
+
+class MediaRef:
+    """What a /play argument points at, parsed once"""
+
+    __slots__ = ('kind', 'id', 'query', 'start')
+
+    def __init__(self, kind, id=None, query=None, start=0):
+        self.kind = kind
+        self.id = id  # Video, playlist or Spotify ID, None for queries
+        self.query = query  # Original text, the search terms for queries
+        self.start = start  # Seconds to start from, from a YouTube t= parameter
+
+    @property
+    def is_playlist(self):
+        return self.kind in PLAYLIST_KINDS
+
+    @property
+    def url(self):
+        """Canonical URL, or the original text for queries and other links"""
+        if self.kind == YOUTUBE_VIDEO:
+            return f"https://www.youtube.com/watch?v={self.id}"
+        if self.kind == YOUTUBE_PLAYLIST:
+            return f"https://www.youtube.com/playlist?list={self.id}"
+        if self.kind in (SPOTIFY_TRACK, SPOTIFY_ALBUM, SPOTIFY_PLAYLIST):
+            return f"https://open.spotify.com/{self.kind.split('_')[1]}/{self.id}"
+        return self.query
+
+    def __repr__(self):
+        if self.id:
+            return f"MediaRef({self.kind!r}, {self.id!r}, start={self.start!r})"
+        return f"MediaRef({self.kind!r}, {self.query!r})"
+
+
+def parse_timestamp(value):
+    """Seconds for a YouTube t= / start= value, 0 if it cannot be read"""
+    match = TIMESTAMP_PATTERN.match(value or "")
+    if not match or not any(match.groups()):
+        return 0
+    hours, minutes, seconds = (int(group or 0) for group in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def parse_ref(text):
+    """Classify a URL or search text into a MediaRef"""
+    text = text.strip()
+    match = SPOTIFY_URI_PATTERN.match(text)
+    if match:
+        return MediaRef(SPOTIFY_KINDS[match.group(1)], match.group(2), text)
+    if not LINK_PATTERN.match(text):
+        return MediaRef(QUERY, query=text)
+
+    parts = urlsplit(text if "://" in text else "https://" + text)
+    host = (parts.hostname or "").lower()
+    if host.endswith("spotify.com"):
+        match = SPOTIFY_PATH_PATTERN.match(parts.path)
+        if match:
+            return MediaRef(SPOTIFY_KINDS[match.group(1)], match.group(2), text)
+        # Episodes, artists, shows... searching YouTube for the link text would only find something unrelated
+        return MediaRef(UNSUPPORTED, query=text)
+    if host.endswith("spotify.link") or host.endswith("spoti.fi"):
+        # Expanding a short link would take a request to Spotify before anything else can happen
+        return MediaRef(UNSUPPORTED, query=text)
+
+    params = parse_qs(parts.query)
+    first = lambda name: params.get(name, [None])[0]  # noqa: E731
+    start = parse_timestamp(first('t') or first('start') or parts.fragment.partition("t=")[2])
+
+    if host == "youtu.be":
+        candidate = parts.path.strip("/").split("/")[0]
+        video_id = candidate if VIDEO_ID.match(candidate) else None
+    else:
+        video_id = first('v')
+        if not video_id:
+            match = VIDEO_PATH_PATTERN.match(parts.path)
+            video_id = match.group(1) if match else None
+        if video_id and not VIDEO_ID.match(video_id):
+            video_id = None
+
+    playlist_id = first('list')
+    if playlist_id and PLAYLIST_ID.match(playlist_id):
+        # A video opened from a playlist queues the whole playlist, like before
+        return MediaRef(YOUTUBE_PLAYLIST, playlist_id, text)
+    if video_id:
+        return MediaRef(YOUTUBE_VIDEO, video_id, text, start)
+    return MediaRef(LINK, query=text)